@@ -1,53 +1,44 @@
+import array
+import bisect
+import codecs
+import collections
+import concurrent.futures
 import enum
+import hashlib
+import itertools
+import marshal
+import os
+import re
+import string
+import sys
+import warnings
+
+CACHE_VERSION = 4
 
 class NFA:
+    STATUS = -1
     def __init__(self):
         self.edge = "EPSILON"
         self.next_1 = None
         self.next_2 = None
         self.function = None
-        self.error = None
+        NFA.STATUS += 1
+        self.status = NFA.STATUS
 class DFA:
     STATUS = -1
     def __init__(self, nfas):
         self.nfas = nfas
         self.accepted = False
         self.function = None
-        self.error = None
-        for i in nfas:
+        for i in sorted(nfas, key = lambda x:x.status):
             if i.next_1 is None and i.next_2 is None:
                 self.accepted = True
             if i.function is not None and self.function is None:
                 self.function = i.function
-            if i.error is not None and self.error is None:
-                self.error = i.error
         DFA.STATUS += 1
         self.status = DFA.STATUS
     def __eq__(self, other):
         return self.status == other.status
-class DFAGroup:
-    STATUS = -1
-    def __init__(self, dfas, status = None):
-        self.dfas = dfas
-        self.function = None
-        self.error = None
-        for i in dfas:
-            if i.function is not None and self.function is None:
-                self.function = i.function
-            if i.error is not None and self.error is None:
-                self.error = i.error
-        if status is None:
-            DFAGroup.STATUS += 1
-            self.status = DFAGroup.STATUS
-        else:
-            self.status = status
-    def get(self, index):
-        return self.dfas[index] if index < len(self.dfas) else None
-    def __str__(self):
-        return str(list(map(lambda x:x.status, self.dfas)))
-    __repr__ = __str__
-    def __eq__(self, other):
-        return self.dfas == other.dfas
 class TokenType(enum.Enum):
     EOS = 0
     ANY = 1
@@ -113,6 +104,30 @@ class Scanner:
             self.current_token = TokenType.L
         else:
             self.current_token = self.tokens.get(self.lexeme, TokenType.L)
+ANY = ((0, sys.maxunicode),)
+DISCARD = object()
+def merge_ranges(ranges):
+    merged = []
+    for lo, hi in sorted(ranges):
+        if merged and lo <= merged[-1][1] + 1:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], hi))
+        else:
+            merged.append((lo, hi))
+    return tuple(merged)
+def complement_ranges(ranges):
+    output = []
+    lo = 0
+    for first, last in ranges:
+        if first > lo:
+            output.append((lo, first - 1))
+        lo = last + 1
+    if lo <= sys.maxunicode:
+        output.append((lo, sys.maxunicode))
+    return tuple(output)
+def in_ranges(ranges, code):
+    index = bisect.bisect_right(ranges, (code, sys.maxunicode)) - 1
+    return index >= 0 and ranges[index][0] <= code <= ranges[index][1]
+
 class Analyzer:
     """
     group ::= ("(" expr ")")*
@@ -123,31 +138,29 @@ class Analyzer:
     """
     def __init__(self, lexer):
         self.lexer = lexer
-        self.ascii_table = set([chr(i) for i in range(127)])
         
     def dodash(self):
         first = ""
-        char_set = set()
+        char_set = []
         while self.lexer.current_token != TokenType.CCL_END:
             if self.lexer.current_token == TokenType.DASH:
                 self.lexer.advance()
-                for c in range(ord(first), ord(self.lexer.lexeme) + 1):
-                    char_set.add(chr(c))
+                char_set.append((ord(first), ord(self.lexer.lexeme)))
                 self.lexer.advance()
             else:
                 first = self.lexer.lexeme
-                char_set.add(self.lexer.lexeme)
+                char_set.append((ord(first), ord(first)))
                 self.lexer.advance()
-        return char_set
+        return merge_ranges(char_set)
     def term(self):
         start = NFA()
         if self.lexer.current_token == TokenType.L:
-            start.edge = self.lexer.lexeme
+            start.edge = ((ord(self.lexer.lexeme), ord(self.lexer.lexeme)),)
             start.next_1 = NFA()
             end = start.next_1
             self.lexer.advance()
         elif self.lexer.current_token == TokenType.ANY:
-            start.edge = self.ascii_table
+            start.edge = ANY
             start.next_1 = NFA()
             end = start.next_1
             self.lexer.advance()
@@ -157,7 +170,7 @@ class Analyzer:
                 self.lexer.advance()
                 char_set = self.dodash()
                 self.lexer.advance()
-                start.edge = self.ascii_table - char_set
+                start.edge = complement_ranges(char_set)
                 start.next_1 = NFA()
                 end = start.next_1
             else:
@@ -220,139 +233,998 @@ class Analyzer:
         return start, end
 
 def closure(input_set):
-    output_set = []
     if not len(input_set) > 0:
         return None
-    stack = []
-    for i in input_set:
-        stack.append(i)
-        output_set.append(i)
+    output_set = set(input_set)
+    stack = list(input_set)
     while len(stack) > 0:
         current = stack.pop()
         if current.edge == "EPSILON":
             if current.next_1 and current.next_1 not in output_set:
-                output_set.append(current.next_1)
+                output_set.add(current.next_1)
                 stack.append(current.next_1)
             if current.next_2 and current.next_2 not in output_set:
-                output_set.append(current.next_2)
+                output_set.add(current.next_2)
                 stack.append(current.next_2)
+    return frozenset(output_set)
+def reachable(nfa):
+    output_set = {nfa}
+    stack = [nfa]
+    while len(stack) > 0:
+        current = stack.pop()
+        for i in (current.next_1, current.next_2):
+            if i is not None and i not in output_set:
+                output_set.add(i)
+                stack.append(i)
     return output_set
-def move(input_set, char):
-    output_set = []
-    for i in input_set:
-        if i.edge == char if isinstance(i.edge, str) else char in i.edge:
-            output_set.append(i.next_1)
-    return output_set
-def nfa_to_dfa(nfa):
-    dfa_list = []
-    dfa_list.append(DFA(closure([nfa])))
+def partition_alphabet(nfas, ignore = ()):
+    """
+    classes: code point ranges no edge can tell apart, nfa_classes: NFA -> classes its edge covers
+    """
+    edges = {}
+    for i in nfas:
+        if i.edge != "EPSILON":
+            edges.setdefault(i.edge, []).append(i)
+    keys = list(edges) + [merge_ranges((ord(char), ord(char)) for char in ignore)]
+    bounds = sorted({bound for key in keys for lo, hi in key for bound in (lo, hi + 1)})
+    signature = [0] * len(bounds)
+    for bit, key in enumerate(keys):
+        for lo, hi in key:
+            for index in range(bisect.bisect_left(bounds, lo), bisect.bisect_left(bounds, hi + 1)):
+                signature[index] |= 1 << bit
+    classes = []
+    class_of = {}
+    interval_class = []
+    for index in range(len(bounds) - 1):
+        if not signature[index]:
+            interval_class.append(-1)
+            continue
+        if signature[index] not in class_of:
+            class_of[signature[index]] = len(classes)
+            classes.append([])
+        classes[class_of[signature[index]]].append((bounds[index], bounds[index + 1] - 1))
+        interval_class.append(class_of[signature[index]])
+    nfa_classes = {}
+    for key, states in edges.items():
+        covered = set()
+        for lo, hi in key:
+            for index in range(bisect.bisect_left(bounds, lo), bisect.bisect_left(bounds, hi + 1)):
+                covered.add(interval_class[index])
+        covered = sorted(covered)
+        for i in states:
+            nfa_classes[i] = covered
+    return classes, nfa_classes
+def nfa_to_dfa(nfa, ignore = ()):
+    DFA.STATUS = -1
+    classes, nfa_classes = partition_alphabet(reachable(nfa), ignore)
+    start = DFA(closure([nfa]))
+    dfa_list = [start]
+    dfa_map = {start.nfas: start}
     jump_table = [{}]
+    closures = {}
     index = 0
     while index < len(dfa_list):
         current = dfa_list[index]
-        for i in range(127):
-            char = chr(i)
-            moved = move(current.nfas, char)
-            if not moved:
-                continue
-            nfa_closure = closure(moved)
-            for j in dfa_list:
-                if j.nfas == nfa_closure:
-                    new_dfa = j
-                    break
-            else:
+        moves = {}
+        for i in current.nfas:
+            for k in nfa_classes.get(i, ()):
+                moves.setdefault(k, set()).add(i.next_1)
+        for k in sorted(moves):
+            for i in moves[k]:
+                if i not in closures:
+                    closures[i] = closure([i])
+            nfa_closure = frozenset().union(*[closures[i] for i in moves[k]])
+            new_dfa = dfa_map.get(nfa_closure)
+            if new_dfa is None:
                 new_dfa = DFA(nfa_closure)
                 dfa_list.append(new_dfa)
+                dfa_map[nfa_closure] = new_dfa
                 jump_table.append({})
-            jump_table[current.status][char] = new_dfa.status
-            if new_dfa.accepted:
-                jump_table[new_dfa.status]["ACCEPT"] = True
+            jump_table[current.status][k] = new_dfa.status
         index += 1
-    return dfa_list, jump_table
-def dfa_in_group(dfa_node, group_list):
-    for group in group_list:
-        for dfa in group.dfas:
-            if dfa.status == dfa_node:
-                output = group
-                return output
-def minimize_dfa(dfa_list, jump_table):
-    accept = []
-    non_accept = []
-    for i in dfa_list:
-        if i.accepted:
-            accept.append(i)
+    return dfa_list, jump_table, classes
+def minimize_dfa(dfa_list, jump_table, classes):
+    """
+    Hopcroft partition refinement, returns the group of every DFA state (the start state is group 0).
+    Accepting states are grouped by function only and are never split, the same as before.
+    """
+    count = len(dfa_list)
+    sink = count
+    inverse = [{} for _ in classes]
+    for dfa in dfa_list:
+        row = jump_table[dfa.status]
+        for k in range(len(classes)):
+            inverse[k].setdefault(row.get(k, sink), []).append(dfa.status)
+    for k in range(len(classes)):
+        inverse[k].setdefault(sink, []).append(sink)
+    initial = {}
+    for dfa in dfa_list:
+        initial.setdefault((dfa.accepted, dfa.function), set()).add(dfa.status)
+    blocks = []
+    fixed = set()
+    for key, block in initial.items():
+        if key[0]:
+            fixed.add(len(blocks))
+        blocks.append(block)
+    blocks.append({sink})
+    group_of = [0] * (count + 1)
+    for index, block in enumerate(blocks):
+        for i in block:
+            group_of[i] = index
+    waiting = [(index, k) for index in range(len(blocks)) for k in range(len(classes))]
+    pending = set(waiting)
+    while waiting:
+        splitter = waiting.pop()
+        pending.discard(splitter)
+        index, k = splitter
+        touched = {}
+        for target in blocks[index]:
+            for i in inverse[k].get(target, ()):
+                touched.setdefault(group_of[i], []).append(i)
+        for index, moved in touched.items():
+            block = blocks[index]
+            if len(moved) == len(block) or index in fixed:
+                continue
+            part = set(moved)
+            block -= part
+            if len(part) > len(block):
+                blocks[index], part = part, block
+            new_index = len(blocks)
+            blocks.append(part)
+            for i in part:
+                group_of[i] = new_index
+            for k in range(len(classes)):
+                if (new_index, k) not in pending:
+                    pending.add((new_index, k))
+                    waiting.append((new_index, k))
+    numbers = {}
+    for i in range(count):
+        numbers.setdefault(group_of[i], len(numbers))
+    return [numbers[group_of[i]] for i in range(count)]
+
+class CharClasses(dict):
+    """
+    Maps code points to class numbers for str.translate, only ASCII is filled in up front,
+    anything else is looked up by binary search over the class ranges on first sight
+    """
+    def __init__(self, classes):
+        ranges = sorted((lo, hi, k + 1) for k, group in enumerate(classes) for lo, hi in group)
+        self.bounds = [lo for lo, hi, k in ranges]
+        self.ranges = ranges
+        self.width = len(classes) + 1
+        super().__init__((code, self.lookup(code)) for code in range(128))
+    def lookup(self, code):
+        index = bisect.bisect_right(self.bounds, code) - 1
+        if index >= 0 and code <= self.ranges[index][1]:
+            return self.ranges[index][2]
+        return 0
+    def __missing__(self, key):
+        self[key] = k = self.lookup(key)
+        return k
+    def encode(self, string):
+        translated = string.translate(self) + "\0"
+        if self.width <= 256:
+            return translated.encode("latin-1")
+        codes = array.array("I")
+        codes.frombytes(translated.encode("utf-32-le"))
+        if sys.byteorder == "big":
+            codes.byteswap()
+        return codes
+
+class TransitionTable:
+    """
+    States are row offsets into transitions (state * width), -1 means no transition.
+    Accepting rows come last, so a state is accepting when it is >= accepting.
+    Class 0 matches nothing and also ends every encoded input.
+    inexact holds the rules whose accepting states were merged in a way that changed the language of the pattern.
+    """
+    def __init__(self, classes, ignore):
+        self.classes = classes
+        self.class_map = CharClasses(classes)
+        self.width = len(classes) + 1
+        self.skip = bytes([0] + [int(chr(classes[k][0][0]) in ignore) for k in range(len(classes))])
+    def save(self, path, fingerprint):
+        data = {
+            "version": CACHE_VERSION,
+            "fingerprint": fingerprint,
+            "byteorder": sys.byteorder,
+            "classes": self.classes,
+            "skip": self.skip,
+            "start": self.start,
+            "accepting": self.accepting,
+            "transitions": self.transitions.tobytes(),
+            "accept": self.accept.tobytes(),
+            "inexact": self.inexact,
+            "keywords": self.keywords,
+        }
+        temp = f"{path}.{os.getpid()}.tmp"
+        with open(temp, "wb") as f:
+            marshal.dump(data, f)
+        os.replace(temp, path)
+    @staticmethod
+    def load(path, fingerprint, count):
+        try:
+            with open(path, "rb") as f:
+                data = marshal.load(f)
+            if (data["version"], data["fingerprint"], data["byteorder"]) != (CACHE_VERSION, fingerprint, sys.byteorder):
+                return None
+            table = TransitionTable(data["classes"], ())
+            table.skip = data["skip"]
+            table.start = data["start"]
+            table.accepting = data["accepting"]
+            table.transitions = array.array("i", data["transitions"])
+            table.accept = array.array("i", data["accept"])
+            table.inexact = tuple(data["inexact"])
+            table.keywords = tuple(data["keywords"])
+            if len(table.transitions) != len(table.accept) * table.width or len(table.skip) != table.width:
+                return None
+            if not -1 <= min(table.accept) <= max(table.accept) < count:
+                return None
+            if not 0 <= table.start < len(table.transitions) or max(table.transitions) >= len(table.transitions):
+                return None
+            return table
+        except Exception:
+            return None
+    def bind(self, functions):
+        actions = [functions[rule] if rule >= 0 else None for rule in self.accept]
+        self.scanner = (self.transitions, self.accepting, self.skip, actions, self.width)
+    def encode(self, string):
+        return self.class_map.encode(string)
+    def winner(self, word):
+        state = self.start
+        for code in self.encode(word)[:-1]:
+            state = self.transitions[state + code]
+            if state < 0:
+                return -1
+        return self.accept[state // self.width] if state >= self.accepting else -1
+
+def create_transition_table(dfa_list, jump_table, classes, group_of, functions, ignore):
+    table = TransitionTable(classes, ignore)
+    width = table.width
+    count = max(group_of) + 1
+    accepted = [False] * count
+    for dfa in dfa_list:
+        accepted[group_of[dfa.status]] = dfa.accepted
+    order = sorted(range(count), key = lambda x:accepted[x])
+    row = [0] * count
+    for index, group in enumerate(order):
+        row[group] = index
+    table.start = row[0] * width
+    table.accepting = accepted.count(False) * width
+    table.transitions = array.array("i", [-1]) * (count * width)
+    table.accept = array.array("i", [-1]) * count
+    rules = {}
+    for index, function in enumerate(functions):
+        rules.setdefault((DISCARD, index) if function is None else function, index)
+    inexact = set()
+    signatures = {}
+    for dfa in dfa_list:
+        signature = sorted((k, group_of[to]) for k, to in jump_table[dfa.status].items())
+        if signatures.setdefault(group_of[dfa.status], signature) != signature:
+            inexact.add(rules[dfa.function])
+        from_row = row[group_of[dfa.status]]
+        for k, to in jump_table[dfa.status].items():
+            table.transitions[from_row * width + k + 1] = row[group_of[to]] * width
+        if dfa.accepted:
+            table.accept[from_row] = rules[dfa.function]
+    table.inexact = tuple(sorted(inexact))
+    table.bind(functions)
+    return table
+
+class LazyDFA:
+    """
+    RE2 style: states are NFA state sets, built when the scanner first takes a transition to them.
+    rows is laid out like TransitionTable.transitions, with -2 for a transition not built yet;
+    column 0 holds -1, or -rule - 3 in an accepting state.
+    When max_states are built the cache is flushed. If that happens again within 10 * max_states characters
+    the cache is kept as it is and every other state goes through one scratch row that is rebuilt
+    on each step, which is plain NFA simulation, for the next 10 * max_states characters.
+    Accepting states are never merged, so tokens follow the patterns even where a TransitionTable has inexact rules.
+    """
+    def __init__(self, root, ignore, keys, max_states):
+        classes, nfa_classes = partition_alphabet(reachable(root), ignore)
+        self.table = TransitionTable(classes, ignore)
+        self.width = self.table.width
+        self.start = closure([root])
+        self.max_states = max(max_states, 1)
+        self.moves = {i: frozenset(k + 1 for k in covered) for i, covered in nfa_classes.items()}
+        self.ranks = {}
+        for index, key in enumerate(keys):
+            self.ranks.setdefault(key, index)
+        self.closures = {}
+        self.restart()
+        self.reset()
+    def restart(self):
+        """
+        Offsets count from the start of every input, the cache is kept.
+        """
+        self.scratch = None
+        self.flushed = None
+    def reset(self):
+        self.rows = array.array("i")
+        self.sets = []
+        self.ids = {}
+        self.ids[self.start] = self.add(self.start)
+    def add(self, nfas, offset = None):
+        if offset is None:
+            offset = len(self.rows)
+            self.rows.extend(array.array("i", [-2]) * self.width)
+            self.sets.append(nfas)
         else:
-            non_accept.append(i)
-    group_list = []
-    if non_accept:
-        group_list.append(DFAGroup(non_accept))
-    if accept:
-        group_list.append(DFAGroup(accept))
-    index = 0
-    group = group_list[index]
-    while group:
-        if len(group.dfas) == 1:
-            index += 1
-            group = group_list[index] if index < len(group_list) else None
-            continue
-        group_keys = []
-        group_values = []
-        for x in group.dfas:
-            if x.accepted:
-                gotos = x.function
-            else:
-                gotos = []
-                for i in range(127):
-                    char = chr(i)
-                    goto = jump_table[x.status].get(char)
-                    goto_group = dfa_in_group(goto, group_list)
-                    gotos.append(goto_group.status if goto_group is not None else None)
-            if gotos in group_keys:
-                group_values[group_keys.index(gotos)].append(x)
+            self.rows[offset:offset + self.width] = array.array("i", [-2]) * self.width
+            self.sets[offset // self.width] = nfas
+        ends = [i for i in nfas if i.function is not None]
+        self.rows[offset] = -self.ranks[min(ends, key = lambda x:x.status).function] - 3 if ends else -1
+        return offset
+    def closure(self, nfa):
+        if nfa not in self.closures:
+            self.closures[nfa] = closure([nfa])
+        return self.closures[nfa]
+    def step(self, state, k, offset):
+        """
+        Builds the transition from state on class k, offset is where in the input it happens.
+        """
+        targets = [i.next_1 for i in self.sets[state // self.width] if k in self.moves.get(i, ())]
+        if not targets:
+            if state != self.scratch:
+                self.rows[state + k] = -1
+            return -1
+        nfas = frozenset().union(*[self.closure(i) for i in targets])
+        target = self.ids.get(nfas)
+        if target is None:
+            if self.scratch is not None:
+                if offset - self.flushed < 10 * self.max_states:
+                    return self.add(nfas, self.scratch)
+                self.scratch = None
+            if len(self.sets) >= self.max_states:
+                if self.flushed is not None and offset - self.flushed < 10 * self.max_states:
+                    self.flushed = offset
+                    self.scratch = self.add(nfas)
+                    return self.scratch
+                self.flushed = offset
+                self.reset()
+                self.ids[nfas] = target = self.add(nfas)
+                return target
+            self.ids[nfas] = target = self.add(nfas)
+        if state != self.scratch:
+            self.rows[state + k] = target
+        return target
+
+class Translator(Analyzer):
+    """
+    Same grammar as Analyzer, but builds a syntax tree for the re backend:
+    ("char", ranges), ("cat", nodes), ("alt", nodes), ("star", node), ("plus", node), ("opt", node)
+    """
+    def term(self):
+        if self.lexer.current_token == TokenType.L:
+            node = ("char", ((ord(self.lexer.lexeme), ord(self.lexer.lexeme)),))
+            self.lexer.advance()
+        elif self.lexer.current_token == TokenType.ANY:
+            node = ("char", ANY)
+            self.lexer.advance()
+        elif self.lexer.current_token == TokenType.CCL_START:
+            self.lexer.advance()
+            if self.lexer.current_token == TokenType.AT_BOL:
+                self.lexer.advance()
+                node = ("char", complement_ranges(self.dodash()))
             else:
-                group_keys.append(gotos)
-                group_values.append([x])
-        if len(group_values) == 1 and group_values[0] == group.dfas:
-            index += 1
-            group = group_list[index] if index < len(group_list) else None
+                node = ("char", self.dodash())
+            self.lexer.advance()
+        elif self.lexer.current_token == TokenType.OPEN_PAREN:
+            self.lexer.advance()
+            node = self.expr()
+            if self.lexer.current_token != TokenType.CLOSE_PAREN:
+                raise ValueError("Missing closing parenthesis")
+            self.lexer.advance()
+        else:
+            raise ValueError(f"Unexpected {self.lexer.current_token}")
+        return node
+    def factor(self):
+        node = self.term()
+        operators = {TokenType.CLOSURE: "star", TokenType.PLUS_CLOSE: "plus", TokenType.OPTIONAL: "opt"}
+        if self.lexer.current_token in operators:
+            node = (operators[self.lexer.current_token], node)
+            self.lexer.advance()
+        return node
+    def factor_conn(self):
+        nodes = [self.factor()]
+        while self.lexer.current_token in (TokenType.L, TokenType.ANY, TokenType.CCL_START, TokenType.OPEN_PAREN):
+            nodes.append(self.factor())
+        return nodes[0] if len(nodes) == 1 else ("cat", nodes)
+    def expr(self):
+        nodes = [self.factor_conn()]
+        while self.lexer.current_token == TokenType.OR:
+            self.lexer.advance()
+            nodes.append(self.factor_conn())
+        return nodes[0] if len(nodes) == 1 else ("alt", nodes)
+
+def nullable(node):
+    kind = node[0]
+    if kind == "char":
+        return False
+    if kind == "cat":
+        return all(nullable(i) for i in node[1])
+    if kind == "alt":
+        return any(nullable(i) for i in node[1])
+    return kind != "plus" or nullable(node[1])
+def glushkov(node):
+    """
+    Positions are the char leaves, returns their ranges, the positions a match can start and end with
+    and the positions that can follow each one.
+    Raises ValueError for what re would try in the wrong order: several nullable branches or a loop over a nullable body.
+    """
+    positions = []
+    follow = []
+    def walk(node):
+        kind = node[0]
+        if kind == "char":
+            positions.append(node[1])
+            follow.append(set())
+            return False, {len(positions) - 1}, {len(positions) - 1}
+        if kind == "cat":
+            empty, first, last = walk(node[1][0])
+            for i in node[1][1:]:
+                next_empty, next_first, next_last = walk(i)
+                for p in last:
+                    follow[p] |= next_first
+                first = first | next_first if empty else first
+                last = last | next_last if next_empty else next_last
+                empty = empty and next_empty
+            return empty, first, last
+        if kind == "alt":
+            results = [walk(i) for i in node[1]]
+            if [empty for empty, first, last in results].count(True) > 1:
+                raise ValueError("More than one nullable branch")
+            return any(i[0] for i in results), set().union(*[i[1] for i in results]), set().union(*[i[2] for i in results])
+        empty, first, last = walk(node[1])
+        if kind != "opt":
+            if empty:
+                raise ValueError("Loop over a nullable body")
+            for p in last:
+                follow[p] |= first
+        return kind != "plus" or empty, first, last
+    empty, first, last = walk(node)
+    return positions, first, last, follow
+def disjoint(positions, group):
+    ranges = sorted(r for p in group for r in positions[p])
+    return all(ranges[i][1] < ranges[i + 1][0] for i in range(len(ranges) - 1))
+def regex_escape(code):
+    return f"\\u{code:04x}" if code < 0x10000 else f"\\U{code:08x}"
+def regex_source(node):
+    kind = node[0]
+    if kind == "char":
+        return "[" + "".join(regex_escape(lo) if lo == hi else f"{regex_escape(lo)}-{regex_escape(hi)}" for lo, hi in node[1]) + "]"
+    if kind == "cat":
+        return "".join(regex_source(i) for i in node[1])
+    if kind == "alt":
+        return "(?:" + "|".join(regex_source(i) for i in sorted(node[1], key = nullable)) + ")"
+    return "(?:" + regex_source(node[1]) + ")" + {"star": "*", "plus": "+", "opt": "?"}[kind]
+def prefix_source(node):
+    """
+    Matches every prefix of node, the empty one included.
+    """
+    kind = node[0]
+    if kind == "char":
+        return regex_source(node) + "?"
+    if kind == "cat":
+        return "(?:" + "|".join("".join(regex_source(i) for i in node[1][:index]) + prefix_source(node[1][index]) for index in range(len(node[1]))) + ")"
+    if kind == "alt":
+        return "(?:" + "|".join(prefix_source(i) for i in node[1]) + ")"
+    if kind == "opt":
+        return prefix_source(node[1])
+    return "(?:" + regex_source(node[1]) + ")*" + prefix_source(node[1])
+def literal_words(node):
+    """
+    The words of a pattern that is nothing but literals or an alternation of them, otherwise None.
+    """
+    words = []
+    for branch in node[1] if node[0] == "alt" else [node]:
+        chars = branch[1] if branch[0] == "cat" else [branch]
+        if not all(i[0] == "char" and len(i[1]) == 1 and i[1][0][0] == i[1][0][1] for i in chars):
+            return None
+        words.append("".join(chr(i[1][0][0]) for i in chars))
+    return words
+def literal_nfa(words):
+    """
+    The words as a trie, shared prefixes share states.
+    """
+    end = NFA()
+    def node(words, depth):
+        branches = [end] if any(len(word) == depth for word in words) else []
+        children = {}
+        for word in words:
+            if len(word) > depth:
+                children.setdefault(word[depth], []).append(word)
+        for char, group in children.items():
+            start = NFA()
+            start.edge = ((ord(char), ord(char)),)
+            start.next_1 = node(group, depth + 1)
+            branches.append(start)
+        while len(branches) > 1:
+            head = NFA()
+            head.next_1 = branches[-2]
+            head.next_2 = branches[-1]
+            branches[-2:] = [head]
+        return branches[0]
+    return node(sorted(set(words)), 0), end
+
+DETOUR = object()
+
+class RegexScanner:
+    """
+    Every top level branch of every pattern is tried where its first character fits: alone as a plain match,
+    or as capturing lookaheads in one combined pattern per character class, where the longest capture wins
+    and the lowest rule on a tie. Re only finds the longest match of a branch when every choice is decided
+    by the next character (Glushkov), anything else stays with the DFA.
+    Only when the last character of a token could be followed by more (tail), the next one fits (follow)
+    and the two really make a prefix of a pattern (viable), the DFA has to tell whether the token is unclosed.
+    A lone branch can only have stopped on one of its last positions, with others the token may be any prefix.
+    Where an inexact rule of the table (see TransitionTable) can start, the DFA lexes the token instead (DETOUR).
+    """
+    def __init__(self, table, branches, ignore):
+        width = table.width
+        entries = {}
+        self.dispatch = [None] * width
+        for k in range(1, width):
+            code = table.classes[k - 1][0][0]
+            candidates = tuple(index for index, (rule, node, first, ends) in enumerate(branches) if in_ranges(first, code))
+            if any(branches[index][0] in table.inexact for index in candidates):
+                self.dispatch[k] = DETOUR
+                continue
+            if candidates and candidates not in entries:
+                if len(candidates) == 1:
+                    source = regex_source(branches[candidates[0]][1])
+                    rules = branches[candidates[0]][0]
+                    tail, follow = branches[candidates[0]][3][0]
+                else:
+                    source = "".join(f"(?:(?=({regex_source(branches[index][1])}))|)" for index in candidates)
+                    rules = tuple(branches[index][0] for index in candidates)
+                    tail = merge_ranges(r for index in candidates for r in branches[index][3][1][0])
+                    follow = merge_ranges(r for index in candidates for r in branches[index][3][1][1])
+                viable = "|".join(prefix_source(branches[index][1]) for index in candidates)
+                entries[candidates] = (
+                    re.compile(source).match,
+                    rules,
+                    bytes([0] + [int(in_ranges(tail, group[0][0])) for group in table.classes]),
+                    bytes([0] + [int(in_ranges(follow, group[0][0])) for group in table.classes]),
+                    re.compile(viable).fullmatch,
+                )
+            self.dispatch[k] = entries.get(candidates)
+        self.ignore = re.compile("[" + "".join(regex_escape(ord(char)) for char in ignore) + "]*").match if ignore else None
+
+def create_regex_scanner(patterns, table, ignore):
+    """
+    Returns None when re can not be made to pick the same tokens as the DFA, patterns left out of the DFA are None.
+    """
+    branches = []
+    for rule, pattern in enumerate(patterns):
+        if pattern is None:
             continue
-        group.__init__(group_values[0], group.status)
-        for groups in group_values[1:]:
-            new_group = DFAGroup(groups)
-            group_list.insert(index, new_group)
-            index -= 1
-        index += 1
-        group = group_list[index] if index < len(group_list) else None
-    return group_list
-def create_transition_table(dfa_list, jump_table, group_list):
-    transition_table = [{} for _ in range(len(group_list))]
-    for dfa in dfa_list:
-        from_group = dfa_in_group(dfa.status, group_list)
-        for i in range(127):
-            char = chr(i)
-            to = jump_table[dfa.status].get(char)
-            if to is None:
+        try:
+            node = Translator(Scanner(pattern)).expr()
+        except (ValueError, IndexError):
+            return None
+        for branch in node[1] if node[0] == "alt" else [node]:
+            try:
+                positions, first, last, follow = glushkov(branch)
+            except ValueError:
+                return None
+            if not disjoint(positions, first) or not all(disjoint(positions, i) for i in follow):
+                return None
+            ends = []
+            for group in (last, range(len(positions))):
+                tail = [p for p in group if follow[p]]
+                ends.append((merge_ranges(r for p in tail for r in positions[p]), merge_ranges(r for p in tail for q in follow[p] for r in positions[q])))
+            branches.append((rule, branch, merge_ranges(r for p in first for r in positions[p]), ends))
+    return RegexScanner(table, branches, ignore)
+
+GENERATED_LEXER = string.Template("""\
+# Generated by PLPG Lexer.generate, do not edit.
+import bisect
+import itertools
+$imports
+
+class Keywords:
+    def __init__(self, words, default):
+        self.words = words
+        self.default = default
+    def __call__(self, lexer):
+        return self.words.get(lexer.string[lexer.begin:lexer.end], self.default)(lexer)
+
+WIDTH = $width
+START = $start
+ACCEPTING = $accepting
+TRANSITIONS = $transitions
+RANGES = $ranges
+ACTIONS = $actions
+
+class CharClasses(dict):
+    def __init__(self):
+        self.bounds = [lo for lo, hi, k in RANGES]
+        super().__init__((code, self.lookup(code)) for code in range(128))
+    def lookup(self, code):
+        index = bisect.bisect_right(self.bounds, code) - 1
+        if index >= 0 and code <= RANGES[index][1]:
+            return RANGES[index][2]
+        return 0
+    def __missing__(self, key):
+        self[key] = k = self.lookup(key)
+        return k
+
+CLASS_MAP = CharClasses()
+
+class Lexer:
+    def __init__(self):
+        self.err = $err
+        self.error = $error
+        self.eoffunc = $eoffunc
+        self.eofcount = $eofcount
+
+    def read(self, string):
+        self.string = string
+        translated = string.translate(CLASS_MAP) + "\\0"
+        $encode
+        self.pos = self.begin = self.end = 0
+        self.line_starts = None
+        self.count = self.eofcount
+        self.tokens = self.scan()
+
+    @property
+    def buffer(self):
+        return self.string[self.begin:self.end]
+
+    @property
+    def span(self):
+        return self.begin, self.end
+
+    def position(self, offset):
+        if self.line_starts is None:
+            self.line_starts = list(itertools.accumulate([len(line) + 1 for line in self.string.split("\\n")], initial = 0))
+        line = bisect.bisect_right(self.line_starts, offset)
+        return line, offset - self.line_starts[line - 1] + 1
+
+    @property
+    def offset(self):
+        return self.pos
+
+    @property
+    def line(self):
+        return self.position(self.pos)[0]
+
+    @property
+    def column(self):
+        return self.position(self.pos)[1]
+
+    def located(self, token):
+        if getattr(token, "offset", 0) is None:
+            token.offset = self.begin
+        return token
+
+    def tokenize(self, string):
+        self.read(string)
+        return self.tokens
+
+    def tokenize_all(self, string):
+        return list(self.tokenize(string))
+
+    def lex(self):
+        for token in self.tokens:
+            return token
+        raise Exception("EOF Error!")
+
+    def scan(self):
+        codes = self.codes
+        length = len(self.string)
+        pos = self.pos
+        while True:
+            $skip_loop
+            begin = end = pos
+            state = $start
+            accepted = -1
+            while True:
+                state = TRANSITIONS[state + codes[pos]]
+                if state < 0:
+                    break
+                pos += 1
+                if state >= $accepting:
+                    accepted = state
+                    end = pos
+            if pos == length:
+                if pos == begin:
+                    break
+                if end != pos and self.err is not None:
+                    self.begin = begin
+                    self.pos = self.end = pos
+                    yield self.located(self.err(self))
+                    continue
+            if accepted < 0:
+                if pos == length:
+                    pos -= 1
+                self.begin = begin
+                self.end = pos + 1
+                self.pos = pos
+                res = self.error(self)
+                pos += 1
+                if res is not None:
+                    self.pos = pos
+                    yield self.located(res)
                 continue
-            to_group = dfa_in_group(to, group_list)
-            transition_table[from_group.status][char] = to_group.status
-        if dfa.error:
-            transition_table[from_group.status]["UNCLOSED"] = from_group.error
-        if dfa.accepted:
-            transition_table[from_group.status]["ACCEPT"] = from_group.function
-    return transition_table
+            pos = end
+            action = ACTIONS[accepted]
+            if action is None:
+                continue
+            self.begin = begin
+            self.pos = self.end = end
+            token = action(self)
+            if getattr(token, "offset", 0) is None:
+                token.offset = begin
+            yield token
+        self.begin = self.end = self.pos = pos
+        while self.eoffunc is not None and self.count > 0:
+            self.count -= 1
+            yield self.located(self.eoffunc(self))
+""")
+
+def read_chunks(source, chunk_size, encoding):
+    if hasattr(source, "read"):
+        read = source.read
+        source = iter(lambda: read(chunk_size) or None, None)
+    decoder = None
+    for chunk in source:
+        if not isinstance(chunk, str):
+            if decoder is None:
+                decoder = codecs.getincrementaldecoder(encoding)()
+            chunk = decoder.decode(chunk)
+        if chunk:
+            yield chunk
+    if decoder is not None:
+        chunk = decoder.decode(b"", True)
+        if chunk:
+            yield chunk
+
+class Incomplete(Exception):
+    pass
+
+STARVED = object()
+
+def fed_chunks(queue):
+    """
+    Chunk source of Lexer.feed: "" when the queue is empty tells refill to wait, None in the queue ends the input.
+    """
+    while True:
+        while queue:
+            chunk = queue.popleft()
+            if chunk is None:
+                return
+            yield chunk
+        yield ""
+
+worker_lexer = None
+
+def start_worker(lexer):
+    global worker_lexer
+    worker_lexer = lexer
+
+def chunk_pieces(text, final):
+    yield text
+    if not final:
+        raise Incomplete()
+
+def lex_chunk(start, end, text, final, line, line_start):
+    """
+    Worker side of Lexer.tokenize_parallel: lexes text, the input from start on, as if a token started there,
+    until the scanner gets to end, or to the end of the input for the last chunk. Returns the tokens, the scanner position after each of them and whether it got
+    there, a wrong guess can run into an error or a token can run past the text. The EOF tokens are left to the parent.
+    """
+    lexer = worker_lexer
+    lexer.read(chunk_pieces(text, final))
+    lexer.count = 0
+    lexer.base = lexer.indexed = start
+    lexer.line_starts = array.array("q", [line_start])
+    lexer.line_base = line - 1
+    buffer = TokenBuffer()
+    afters = array.array("q")
+    try:
+        for token in lexer.tokens:
+            buffer.append(token, lexer.base + lexer.begin, lexer.base + lexer.end)
+            afters.append(lexer.base + lexer.pos)
+            if afters[-1] >= end and end < start + len(text):
+                break
+    except Exception:
+        return buffer, afters, False
+    return buffer, afters, True
+
+def string_pieces(string, pos, size):
+    while pos < len(string):
+        yield string[pos:pos + size]
+        pos += size
+
+def qualname(function):
+    return f"{getattr(function, '__module__', None)}.{getattr(function, '__qualname__', type(function).__qualname__)}"
+
+class Keywords:
+    """
+    Callback of a rule that also stands for words of literal rules taken out of the automaton.
+    """
+    __slots__ = ("words", "default")
+    def __init__(self, words, default):
+        self.words = words
+        self.default = default
+    def __call__(self, lexer):
+        return self.words.get(lexer.buffer, self.default)(lexer)
 
 class Token:
-    def __init__(self, type, value):
+    __slots__ = ("type", "value", "offset", "id")
+    def __init__(self, type, value, offset = None):
         self.type = type
         self.value = value
+        self.offset = offset
+        self.id = -1
     def __str__(self):
         return f"Token({self.type}: {self.value})"
     __repr__ = __str__
 
+class TokenBuffer:
+    """
+    Tokens by column: interned type ids, start and end offsets, and a side list for the values that are not None,
+    refs is the index into it or -1. Indexing or iterating makes Token objects on demand.
+    """
+    def __init__(self):
+        self.names = []
+        self.ids = {}
+        self.types = array.array("i")
+        self.starts = array.array("q")
+        self.ends = array.array("q")
+        self.refs = array.array("i")
+        self.values = [None]
+    def __len__(self):
+        return len(self.types)
+    def __getitem__(self, index):
+        return Token(self.names[self.types[index]], self.values[self.refs[index] + 1], self.starts[index])
+    def __iter__(self):
+        names, values = self.names, self.values
+        for type, ref, start in zip(self.types, self.refs, self.starts):
+            yield Token(names[type], values[ref + 1], start)
+    def type(self, index):
+        return self.names[self.types[index]]
+    def value(self, index):
+        return self.values[self.refs[index] + 1]
+    def span(self, index):
+        return self.starts[index], self.ends[index]
+    def intern(self, name):
+        type = self.ids.get(name)
+        if type is None:
+            type = self.ids[name] = len(self.names)
+            self.names.append(name)
+        return type
+    def append(self, token, start, end):
+        if token.value is None:
+            self.refs.append(-1)
+        else:
+            self.refs.append(len(self.values) - 1)
+            self.values.append(token.value)
+        self.types.append(self.intern(token.type))
+        self.starts.append(start)
+        self.ends.append(end)
+    def extend(self, other, index = 0):
+        """
+        Appends the tokens of other from index on.
+        """
+        types = [self.intern(name) for name in other.names]
+        self.types.extend(array.array("i", [types[type] for type in other.types[index:]]))
+        self.starts.extend(other.starts[index:])
+        self.ends.extend(other.ends[index:])
+        for ref in other.refs[index:]:
+            if ref < 0:
+                self.refs.append(-1)
+            else:
+                self.refs.append(len(self.values) - 1)
+                self.values.append(other.values[ref + 1])
+
+class Document:
+    """
+    A text that stays lexed across edits, see Lexer.document. Tokens are read like from a TokenBuffer.
+    Every token also keeps the scanner position after it and its reach, the furthest position the scanner had
+    looked at by then: an edit is lexed again from the last token that did not reach it, until the scanner gets
+    to a position behind the edit that the old scanner was at too.
+    Positions from index gap on are stored relative to the end of the text, so edits do not have to shift them.
+    """
+    def __init__(self, lexer, string):
+        self.lexer = lexer
+        self.string = ""
+        self.names = []
+        self.ids = {}
+        self.types = array.array("i")
+        self.values = []
+        self.starts = array.array("q")
+        self.ends = array.array("q")
+        self.afters = array.array("q")
+        self.reaches = array.array("q")
+        self.gap = 0
+        self.edit(0, 0, string)
+    def __len__(self):
+        return len(self.types)
+    def __getitem__(self, index):
+        index = range(len(self.types))[index]
+        return Token(self.names[self.types[index]], self.values[index], self.position(self.starts, index))
+    def __iter__(self):
+        for index in range(len(self.types)):
+            yield self[index]
+    def type(self, index):
+        return self.names[self.types[index]]
+    def value(self, index):
+        return self.values[index]
+    def span(self, index):
+        index = range(len(self.types))[index]
+        return self.position(self.starts, index), self.position(self.ends, index)
+    def position(self, positions, index):
+        return positions[index] if index < self.gap else positions[index] + len(self.string)
+    def move(self, gap):
+        length = len(self.string) if gap > self.gap else -len(self.string)
+        low, high = sorted((self.gap, gap))
+        for positions in (self.starts, self.ends, self.afters, self.reaches):
+            positions[low:high] = array.array("q", map(length.__add__, positions[low:high]))
+        self.gap = gap
+    def edit(self, offset, removed, inserted):
+        """
+        Replaces removed characters at offset with inserted.
+        Returns (first, stop, new_stop): tokens first:stop were replaced by the ones now at first:new_stop.
+        """
+        old = self.string
+        if not 0 <= offset <= offset + removed <= len(old):
+            raise ValueError(f"Edit {offset}:{offset + removed} out of range")
+        string = old[:offset] + inserted + old[offset + removed:]
+        delta = len(string) - len(old)
+        count = len(self.types)
+        after = lambda index: self.position(self.afters, index)
+        first = bisect.bisect_left(range(count), offset, key = lambda index: self.position(self.reaches, index))
+        start = after(first - 1) if first else 0
+        lexer = self.lexer
+        lexer.read(string[i:i + 4096] for i in range(start, len(string), 4096))
+        lexer.base = lexer.indexed = start
+        lexer.line_starts = array.array("q", [string.rfind("\n", 0, start) + 1])
+        lexer.line_base = string.count("\n", 0, start)
+        tokens = []
+        stop = count
+        for token in lexer.tokens:
+            tokens.append((token, lexer.base + lexer.begin, lexer.base + lexer.end, lexer.base + lexer.pos, lexer.reach))
+            pos = lexer.base + lexer.pos - delta
+            if offset + removed <= pos < len(old):
+                index = bisect.bisect_left(range(count), pos, max(first - 1, 0), key = after)
+                if index < count and after(index) == pos:
+                    stop = index + 1
+                    break
+        self.move(stop)
+        self.string = string
+        types = []
+        for token, *_ in tokens:
+            type = self.ids.get(token.type)
+            if type is None:
+                type = self.ids[token.type] = len(self.names)
+                self.names.append(token.type)
+            types.append(type)
+        self.types[first:stop] = array.array("i", types)
+        self.values[first:stop] = [token.value for token, *_ in tokens]
+        for column, positions in enumerate((self.starts, self.ends, self.afters, self.reaches), 1):
+            positions[first:stop] = array.array("q", [row[column] for row in tokens])
+        self.gap = first + len(tokens)
+        reach = self.reaches[self.gap - 1] if self.gap else -1
+        for index in range(self.gap, len(self.types)):
+            if self.reaches[index] + len(string) >= reach:
+                break
+            self.reaches[index] = reach - len(string)
+        return first, stop, self.gap
+
 class Lexer:
     def __init__(self):
         self.patterns = []
         self.ignore = []
+        self.err = None
+        self.error = None
+        self.eoffunc = None
+        self.count = self.eofcount = 0
+        self.terminals = {}
+        self.fed = None
     
     def pattern(self, pattern):
         def decorator(func):
@@ -360,6 +1232,14 @@ class Lexer:
             return func
         return decorator
 
+    def skip(self, pattern):
+        """
+        Input matching pattern is dropped inside the scanner, without a callback.
+        Works as a plain call or as a decorator, the decorated function is never called.
+        """
+        self.patterns.append((pattern, None))
+        return lambda func: func
+
     def unclosed(self, func):
         self.err = func
 
@@ -369,87 +1249,746 @@ class Lexer:
     def eof(self, count = 1):
         def decorator(func):
             self.eoffunc = func
-            self.count = count
+            self.count = self.eofcount = count
             return func
         return decorator
     
-    def compile(self):
-        pattern, function = self.patterns[0]
-        lexer = Scanner(pattern)
-        parser = Analyzer(lexer)
-        start, end = parser.expr()
-        end.function = function
-        root = NFA()
-        root.next_1 = start
-        for pattern, function in self.patterns[1:]:
-            lexer = Scanner(pattern)
-            parser = Analyzer(lexer)
-            start, end = parser.expr()
-            end.function = function
+    def fingerprint(self):
+        """
+        Besides the patterns and the names of their callbacks, the rules sharing a callback object: accepting states
+        are grouped by callback, each rule is keyed by the first rule with the same callback, a skip rule by itself.
+        """
+        first = {}
+        shared = [index if function is None else first.setdefault(id(function), index) for index, (pattern, function) in enumerate(self.patterns)]
+        spec = [(pattern, qualname(function)) for pattern, function in self.patterns]
+        return hashlib.sha256(repr((CACHE_VERSION, spec, shared, sorted(self.ignore))).encode()).hexdigest()
+
+    def compile(self, cache = None, backend = "dfa", max_states = 10000):
+        """
+        backend "re" scans with the re module where it picks the same tokens as the DFA: a token that can start with
+        the first character of an inexact rule (see TransitionTable) is left to the DFA, and so is the whole input
+        when a pattern is out of reach of re. self.backend tells which one is used in the end.
+        backend "lazy" builds DFA states only when the input reaches them, at most max_states at a time (see LazyDFA).
+        Its tokens follow the patterns, where those of "dfa" and "re" can differ for a rule TransitionTable calls
+        inexact, which is only known once the whole DFA is built. It has no table to cache, compile warns if given one.
+        """
+        if backend not in ("dfa", "re", "lazy"):
+            raise ValueError(f"Unknown backend {backend!r}")
+        self.functions = [function for pattern, function in self.patterns]
+        self.transition_table = None
+        self.regex_scanner = self.lazy = None
+        self.backend = backend
+        nodes = []
+        for pattern, function in self.patterns:
+            try:
+                nodes.append(Translator(Scanner(pattern)).expr())
+            except (ValueError, IndexError):
+                nodes.append(None)
+        ignore = self.ignored(nodes)
+        if backend == "lazy":
+            self.literals, self.removed = self.keywords(nodes)
+            kept = [(index, re.compile(regex_source(node)).fullmatch) for index, node in enumerate(nodes) if index not in self.removed and node is not None]
+            def winner(word):
+                return min((index for index, match in kept if match(word)), default = -1)
+            while True:
+                self.actions, failed = self.dispatch(winner)
+                if not failed:
+                    break
+                self.removed -= failed
+            self.lazy = LazyDFA(self.nfa(), ignore, self.keys, max_states)
+            self.transition_table = self.lazy.table
+            if cache is not None:
+                warnings.warn("Lexer backend 'lazy' builds no table, the cache is not used")
+            return
+        if cache is not None:
+            fingerprint = self.fingerprint()
+            table = TransitionTable.load(cache, fingerprint, len(self.patterns))
+            if table is not None:
+                self.literals, self.removed = self.literal_rules(nodes), set(table.keywords)
+                if self.removed <= set(self.literals):
+                    self.actions, failed = self.dispatch(table.winner)
+                    table.bind(self.actions)
+                    self.transition_table = table
+        if self.transition_table is None:
+            self.literals, self.removed = self.keywords(nodes)
+            self.build(cache, ignore)
+        if backend == "re":
+            patterns = [None if index in self.removed else pattern for index, (pattern, function) in enumerate(self.patterns)]
+            self.regex_scanner = create_regex_scanner(patterns, self.transition_table, ignore)
+        self.backend = "dfa" if self.regex_scanner is None else "re"
+
+    def keywords(self, nodes):
+        """
+        Literal rules (words, see literal_words) and the ones among them that can be left out of the automaton:
+        every word is matched by some rule that is not a literal, so the token comes out anyway
+        and a lookup of the word can pick the literal rule where it comes first (see dispatch).
+        """
+        literals = self.literal_rules(nodes)
+        if not literals:
+            return literals, set()
+        general = [re.compile(regex_source(node)).fullmatch for index, node in enumerate(nodes) if index not in literals]
+        removed = set()
+        for index, words in literals.items():
+            if self.functions[index] is not None and all(any(match(word) for match in general) for word in words):
+                removed.add(index)
+        return literals, removed
+
+    def literal_rules(self, nodes):
+        """
+        The words of every literal rule by rule, none when a pattern did not parse.
+        """
+        if None in nodes:
+            return {}
+        literals = {}
+        for index, node in enumerate(nodes):
+            words = literal_words(node)
+            if words is not None:
+                literals[index] = words
+        return literals
+
+    def dispatch(self, winner):
+        """
+        Callbacks by rule, a rule the automaton picks for a word of an earlier literal rule left out of it
+        calls that rule's callback for that word instead. winner(word) is the rule the automaton picks
+        for exactly the word, or -1. Also returns the literal rules that can not be left out after all.
+        """
+        words = {}
+        failed = set()
+        for index in sorted(self.removed):
+            for word in self.literals[index]:
+                rule = winner(word)
+                if rule < 0 or self.functions[rule] is None:
+                    failed.add(index)
+                elif index < rule:
+                    words.setdefault(rule, {}).setdefault(word, self.functions[index])
+        return [Keywords(words[rule], function) if rule in words else function for rule, function in enumerate(self.functions)], failed
+
+    def ignored(self, nodes):
+        """
+        ignore plus the characters of skip rules that only match runs of one small class no other rule starts with,
+        those are left to the skip loop of the scanner, which is faster than going through the DFA.
+        """
+        ignore = list(self.ignore)
+        firsts = []
+        for node in nodes:
+            try:
+                positions, first, last, follow = glushkov(node)
+            except (ValueError, TypeError):
+                return ignore
+            firsts.append(merge_ranges(r for p in first for r in positions[p]))
+        for index, (pattern, function) in enumerate(self.patterns):
+            node = nodes[index]
+            if function is not None or node[0] not in ("char", "star", "plus"):
+                continue
+            if node[0] != "char":
+                node = node[1]
+            if node[0] != "char" or sum(hi - lo + 1 for lo, hi in node[1]) > 256:
+                continue
+            ranges = node[1]
+            if any(lo <= hi_ and lo_ <= hi for other, first in enumerate(firsts) if other != index for lo, hi in ranges for lo_, hi_ in first):
+                continue
+            ignore.extend(chr(code) for lo, hi in ranges for code in range(lo, hi + 1) if chr(code) not in ignore)
+        return ignore
+
+    def nfa(self):
+        """
+        Chains the patterns under one root, the end state of every pattern carries its key:
+        the callback, or (DISCARD, index) for a skip rule. Literal rules are tries, removed ones are left out.
+        """
+        self.keys = keys = [(DISCARD, index) if function is None else function for index, function in enumerate(self.functions)]
+        root = None
+        for index, (pattern, function) in enumerate(self.patterns):
+            if index in self.removed:
+                continue
+            if index in self.literals:
+                start, end = literal_nfa(self.literals[index])
+            else:
+                lexer = Scanner(pattern)
+                parser = Analyzer(lexer)
+                start, end = parser.expr()
+            end.function = keys[index]
+            if root is None:
+                root = NFA()
+                root.next_1 = start
+                continue
             root.next_2 = start
             new_root = NFA()
             new_root.next_1 = root
             root = new_root
-        dfa_list, jump_table = nfa_to_dfa(root)
-        self.group_list = minimize_dfa(dfa_list, jump_table)
-        self.transition_table = create_transition_table(dfa_list, jump_table, self.group_list)
+        return root
 
-    def read(self, string):
-        self.string = string
-        self.pos = 0
-        self.char = string[0]
-        self.status = self.start = dfa_in_group(0, self.group_list).status
-        self.back = None
-        self.buffer = ""
-        self.line = 1
-        self.column = 1
+    def build(self, cache, ignore):
+        while True:
+            dfa_list, jump_table, classes = nfa_to_dfa(self.nfa(), ignore)
+            group_of = minimize_dfa(dfa_list, jump_table, classes)
+            self.transition_table = create_transition_table(dfa_list, jump_table, classes, group_of, self.functions, ignore)
+            self.actions, failed = self.dispatch(self.transition_table.winner)
+            if not failed:
+                break
+            self.removed -= failed
+        self.transition_table.keywords = tuple(sorted(self.removed))
+        self.transition_table.bind(self.actions)
+        if cache is not None:
+            try:
+                self.transition_table.save(cache, self.fingerprint())
+            except OSError:
+                pass
 
-    def advance(self):
-        if self.char == "\n":
-            self.line += 1
-            self.column = 1
+    def generate(self, path):
+        if self.lazy is not None:
+            raise ValueError("A lazy lexer has no table to generate, compile it with backend 'dfa'")
+        table = self.transition_table
+        modules = {}
+        def reference(function):
+            if function is None:
+                return "None"
+            if isinstance(function, Keywords):
+                words = ", ".join(f"{word!r}: {reference(callback)}" for word, callback in function.words.items())
+                return f"Keywords({{{words}}}, {reference(function.default)})"
+            module = getattr(function, "__module__", None)
+            name = getattr(function, "__qualname__", "")
+            if module is None or not name or "<" in name:
+                raise ValueError(f"Callback {qualname(function)} can not be imported by name")
+            modules.setdefault(module, f"_{len(modules)}")
+            return f"{modules[module]}.{name}"
+        actions = {}
+        for row, rule in enumerate(table.accept):
+            if rule >= 0:
+                actions[row * table.width] = reference(self.actions[rule])
+        if any(table.skip):
+            skip_loop = f"while {table.skip!r}[codes[pos]]:\n                pos += 1"
         else:
-            self.column += 1
-        self.pos += 1
-        self.char = self.string[self.pos] if self.pos < len(self.string) else None
+            skip_loop = "pass"
+        if table.width <= 256:
+            encode = 'self.codes = translated.encode("latin-1")'
+        else:
+            encode = 'self.codes = [ord(char) for char in translated]'
+        err, error, eoffunc = reference(self.err), reference(self.error), reference(self.eoffunc)
+        source = GENERATED_LEXER.substitute(
+            imports = "\n".join(f"import {module} as {alias}" for module, alias in modules.items()),
+            width = table.width,
+            start = table.start,
+            accepting = table.accepting,
+            transitions = repr(tuple(table.transitions)),
+            ranges = repr(table.class_map.ranges),
+            actions = "{" + ", ".join(f"{k}: {v}" for k, v in actions.items()) + "}",
+            err = err,
+            error = error,
+            eoffunc = eoffunc,
+            eofcount = self.eofcount,
+            encode = encode,
+            skip_loop = skip_loop,
+        )
+        with open(path, "w", encoding = "utf-8") as f:
+            f.write(source)
+
+    def read(self, source, chunk_size = 65536, encoding = "utf-8"):
+        """
+        source is a str, a text or binary file object (mmap included) or an iterable of str/bytes chunks.
+        Anything but a str is read chunk by chunk into a window that only keeps the unfinished token.
+        """
+        if isinstance(source, str):
+            self.chunks = None
+        else:
+            self.chunks = read_chunks(source, chunk_size, encoding)
+            source = ""
+        self.string = source
+        self.codes = self.transition_table.encode(source)
+        self.pos = self.begin = self.end = 0
+        self.base = self.indexed = 0
+        self.line_starts = array.array("q", [0])
+        self.line_base = 0
+        self.count = self.eofcount
+        self.fed = None
+        if self.lazy is not None:
+            self.lazy.restart()
+            self.tokens = self.scan_lazy()
+        elif self.chunks is None and self.regex_scanner is not None:
+            self.tokens = self.scan_regex()
+        else:
+            self.tokens = self.scan()
+
+    def feed(self, chunk, final = False, encoding = "utf-8"):
+        """
+        Push counterpart of read: lexes chunk (str or bytes) after the ones fed before and returns the tokens it
+        finishes, an unfinished token waits for the next chunk. final ends the input and gives the EOF tokens too,
+        the next feed starts a new one, as it does after an exception out of a callback.
+        """
+        if self.fed is None:
+            self.read(())
+            self.fed = collections.deque()
+            self.chunks = fed_chunks(self.fed)
+            self.decoder = None
+        if not isinstance(chunk, str):
+            if self.decoder is None:
+                self.decoder = codecs.getincrementaldecoder(encoding)()
+            chunk = self.decoder.decode(chunk, final)
+        elif final and self.decoder is not None:
+            chunk += self.decoder.decode(b"", True)
+        if chunk:
+            self.fed.append(chunk)
+        if final:
+            self.fed.append(None)
+        tokens = []
+        try:
+            for token in self.tokens:
+                if token is STARVED:
+                    return tokens
+                tokens.append(token)
+        except BaseException:
+            self.fed = None
+            raise
+        self.fed = None
+        return tokens
+
+    def refill(self, keep):
+        """
+        Returns True when a fed lexer has no chunk to go on with.
+        """
+        self.forget(self.base + keep)
+        self.base += keep
+        chunk = next(self.chunks, None)
+        if chunk is None:
+            self.chunks = None
+            self.string = self.string[keep:]
+            self.codes = self.codes[keep:]
+        else:
+            self.string = self.string[keep:] + chunk
+            self.codes = self.codes[keep:-1] + self.transition_table.encode(chunk)
+        return chunk == ""
+
+    @property
+    def buffer(self):
+        return self.string[self.begin:self.end]
+
+    @property
+    def span(self):
+        return self.base + self.begin, self.base + self.end
+
+    def index(self, offset):
+        """
+        Extends line_starts, the offsets every line starts at, up to offset.
+        """
+        if offset > self.indexed:
+            lines = self.string[self.indexed - self.base:offset - self.base].split("\n")
+            lines.pop()
+            self.line_starts.extend(itertools.islice(itertools.accumulate([len(line) + 1 for line in lines], initial = self.indexed), 1, None))
+            self.indexed = offset
+
+    def forget(self, offset):
+        """
+        Drops the line starts before the line offset is in, the text before offset is about to leave the window.
+        Text that was never indexed is only counted.
+        """
+        if offset > self.indexed:
+            start, end = self.indexed - self.base, offset - self.base
+            newlines = self.string.count("\n", start, end)
+            self.line_base += len(self.line_starts) - 1 + newlines
+            line_start = self.base + self.string.rfind("\n", start, end) + 1 if newlines else self.line_starts[-1]
+            self.line_starts = array.array("q", [line_start])
+            self.indexed = offset
+        else:
+            line = bisect.bisect_right(self.line_starts, offset)
+            self.line_base += line - 1
+            del self.line_starts[:line - 1]
+
+    def position(self, offset):
+        """
+        (line, column) of an offset into the input, both counted from 1.
+        Only offsets from the start of the line the window begins in on, the text streamed past that is forgotten.
+        """
+        if offset < self.line_starts[0]:
+            raise ValueError(f"Offset {offset} was streamed past")
+        self.index(min(offset, self.base + len(self.string)))
+        line = bisect.bisect_right(self.line_starts, offset)
+        return self.line_base + line, offset - self.line_starts[line - 1] + 1
+
+    @property
+    def offset(self):
+        return self.base + self.pos
+
+    @property
+    def line(self):
+        return self.position(self.base + self.pos)[0]
+
+    @property
+    def column(self):
+        return self.position(self.base + self.pos)[1]
+
+    def located(self, token):
+        if isinstance(token, Token):
+            if token.offset is None:
+                token.offset = self.base + self.begin
+            token.id = self.terminals.get(token.type, -1)
+        return token
+
+    def tokenize(self, string):
+        self.read(string)
+        return self.tokens
+
+    def tokenize_all(self, string):
+        return list(self.tokenize(string))
+
+    def tokenize_buffer(self, source, chunk_size = 65536, encoding = "utf-8"):
+        """
+        Lexes the whole input into a TokenBuffer, the Token objects of the callbacks are dropped right away.
+        """
+        self.read(source, chunk_size, encoding)
+        buffer = TokenBuffer()
+        ids, names, values = buffer.ids, buffer.names, buffer.values
+        types, starts, ends, refs = buffer.types, buffer.starts, buffer.ends, buffer.refs
+        for token in self.tokens:
+            type = ids.get(token.type)
+            if type is None:
+                type = ids[token.type] = len(names)
+                names.append(token.type)
+            if token.value is None:
+                refs.append(-1)
+            else:
+                refs.append(len(values) - 1)
+                values.append(token.value)
+            types.append(type)
+            starts.append(self.base + self.begin)
+            ends.append(self.base + self.end)
+        return buffer
+
+    def document(self, string):
+        """
+        Lexes string into a Document, which Document.edit only lexes again around the edit.
+        """
+        if self.lazy is not None:
+            raise ValueError("document needs the dfa or re backend")
+        return Document(self, string)
+
+    def tokenize_parallel(self, string, workers = None, chunk_size = 1 << 20, boundary = None):
+        """
+        tokenize_buffer for a str on a process pool. Every chunk is lexed as if a token started at its first
+        character, or at the first position where boundary(string, pos) holds; wherever that guess was wrong
+        the input is lexed again here until the scanner meets a position the chunk's scanner was at.
+        The lexer is pickled to the workers, so callbacks have to be importable and free of side effects.
+        """
+        if self.lazy is not None:
+            raise ValueError("tokenize_parallel needs the dfa or re backend")
+        length = len(string)
+        cuts = [0]
+        while cuts[-1] + chunk_size < length:
+            cut = cuts[-1] + chunk_size
+            if boundary is not None:
+                limit = min(cut + chunk_size, length)
+                while cut < limit and not boundary(string, cut):
+                    cut += 1
+                if cut == length:
+                    break
+            cuts.append(cut)
+        margin = max(4096, chunk_size // 8)
+        jobs = []
+        line, line_start, previous = 1, 0, 0
+        for start, end in zip(cuts, cuts[1:] + [length]):
+            newlines = string.count("\n", previous, start)
+            if newlines:
+                line += newlines
+                line_start = string.rfind("\n", previous, start) + 1
+            previous = start
+            final = end + margin >= length
+            jobs.append((start, end, string[start:] if final else string[start:end + margin], final, line, line_start))
+        with concurrent.futures.ProcessPoolExecutor(workers, initializer = start_worker, initargs = (self,)) as pool:
+            results = list(pool.map(lex_chunk, *zip(*jobs)))
+        return self.stitch(string, cuts, results)
+
+    def stitch(self, string, cuts, results):
+        merged = TokenBuffer()
+        positions = []
+        for start, (buffer, afters, done) in zip(cuts, results):
+            after = {start: 0}
+            for index, pos in enumerate(afters):
+                after.setdefault(pos, index + 1)
+            positions.append(after)
+        pos = i = 0
+        lines = [1, 0, 0]
+        tokens = None
+        while True:
+            while i + 1 < len(cuts) and pos >= cuts[i + 1]:
+                i += 1
+            buffer, afters, done = results[i]
+            index = positions[i].get(pos)
+            if index is not None and (index < len(afters) or done):
+                tokens = None
+                merged.extend(buffer, index)
+                if index < len(afters):
+                    pos = afters[-1]
+                if done:
+                    if i + 1 == len(cuts) or pos < cuts[i + 1]:
+                        break
+                    continue
+            if tokens is None:
+                tokens = self.resume(string, pos, lines)
+                self.count = 0
+            token = next(tokens, None)
+            if token is None:
+                break
+            merged.append(token, self.base + self.begin, self.base + self.end)
+            pos = self.base + self.pos
+        for token in self.resume(string, pos, lines):
+            merged.append(token, self.base + self.begin, self.base + self.end)
+        return merged
+
+    def resume(self, string, pos, lines):
+        """
+        Lexes string from pos on for stitch, encoding it a window at a time. lines is the line, the offset it
+        starts at and the offset they were counted up to, carried from one call to the next.
+        """
+        line, line_start, previous = lines
+        newlines = string.count("\n", previous, pos)
+        if newlines:
+            line += newlines
+            line_start = string.rfind("\n", previous, pos) + 1
+        lines[:] = line, line_start, pos
+        self.read(string_pieces(string, pos, 65536))
+        self.base = self.indexed = pos
+        self.line_starts = array.array("q", [line_start])
+        self.line_base = line - 1
+        return self.tokens
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        for name in ("tokens", "chunks", "string", "codes"):
+            state.pop(name, None)
+        state["fed"] = None
+        return state
 
     def lex(self):
-        while self.char is not None:
-            if self.char in self.ignore and self.status == self.start:
-                self.advance()
+        for token in self.tokens:
+            return token
+        raise Exception("EOF Error!")
+
+    def scan(self, turns = -1):
+        """
+        With turns, returns True after that many tokens, skipped ones included, unless the input ends first.
+        """
+        table = self.transition_table
+        transitions, accepting, skip, actions, width = table.scanner
+        codes = self.codes
+        length = len(self.string)
+        pos = self.pos
+        reach = -1
+        while turns:
+            turns -= 1
+            while skip[codes[pos]]:
+                pos += 1
+            begin = end = pos
+            state = table.start
+            accepted = -1
+            while True:
+                state = transitions[state + codes[pos]]
+                if state < 0:
+                    break
+                pos += 1
+                if state >= accepting:
+                    accepted = state
+                    end = pos
+            if pos > reach:
+                reach = pos
+            if pos == length:
+                if self.chunks is not None:
+                    starved = self.refill(begin)
+                    codes = self.codes
+                    length = len(self.string)
+                    reach -= begin
+                    pos = 0
+                    if starved:
+                        yield STARVED
+                    continue
+                if pos == begin:
+                    break
+                if end != pos and self.err is not None:
+                    self.begin = begin
+                    self.pos = self.end = pos
+                    self.reach = self.base + reach
+                    yield self.located(self.err(self))
+                    continue
+            if accepted < 0:
+                if pos == length:
+                    pos -= 1
+                self.begin = begin
+                self.end = pos + 1
+                self.pos = pos
+                res = self.error(self)
+                pos += 1
+                if res is not None:
+                    self.pos = pos
+                    self.reach = self.base + reach
+                    yield self.located(res)
+                continue
+            pos = end
+            action = actions[accepted // width]
+            if action is None:
                 continue
-            self.buffer += self.char
-            status = self.status = self.transition_table[self.status].get(self.char)
-            if status is None:
-                if not self.back:
-                    self.error(self)
+            self.begin = begin
+            self.pos = self.end = end
+            token = action(self)
+            if token.__class__ is Token:
+                if token.offset is None:
+                    token.offset = self.base + begin
+                token.id = self.terminals.get(token.type, -1)
+            self.reach = self.base + reach
+            yield token
+        else:
+            self.pos = pos
+            return True
+        self.begin = self.end = self.pos = pos
+        self.reach = self.base + reach
+        while self.eoffunc is not None and self.count > 0:
+            self.count -= 1
+            yield self.located(self.eoffunc(self))
+
+    def scan_regex(self):
+        """
+        Hands a token over to scan for anything but a plain token: no match, a token the DFA
+        would follow to the end of the input (unclosed), or the end itself, and goes on after it.
+        """
+        table = self.transition_table
+        transitions, accepting, skip, row_actions, width = table.scanner
+        dispatch, ignore = self.regex_scanner.dispatch, self.regex_scanner.ignore
+        actions = self.actions
+        codes = self.codes
+        string = self.string
+        length = len(string)
+        pos = self.pos
+        while True:
+            while True:
+                if skip[codes[pos]]:
+                    pos += 1
+                    if skip[codes[pos]]:
+                        pos = ignore(string, pos).end()
+                entry = dispatch[codes[pos]]
+                if entry is None:
+                    break
+                if entry is DETOUR:
+                    state = table.start
+                    accepted = -1
+                    end = i = pos
+                    while True:
+                        state = transitions[state + codes[i]]
+                        if state < 0:
+                            break
+                        i += 1
+                        if state >= accepting:
+                            accepted = state
+                            end = i
+                    if i == length or accepted < 0:
+                        break
+                    action = row_actions[accepted // width]
                 else:
-                    self.pos, function = self.back
-                    self.buffer = self.buffer[:-1]
-                    self.status = self.start
-                    res = function(self)
-                    self.buffer = ""
-                    self.back = None
-                    self.advance()
-                    self.status = self.start
-                    return res
-            else:
-                if "ACCEPT" in self.transition_table[status]:
-                    function = self.transition_table[status]["ACCEPT"]
-                    self.back = (self.pos, function)
-                    if self.pos == len(self.string) - 1:
-                        res = function(self)
-                        self.advance()
-                        self.status = self.start
-                        return res
-            self.advance()
-        if self.char is None:
-            if self.status != self.start:
-                res = self.err(self)
-                return res
-            if self.eof is not None and self.count > 0:
-                res = self.eoffunc(self)
-                self.count -= 1
-                return res
-            else:
-                raise Exception("EOF Error!")
+                    match, rule, tail, follow, viable = entry
+                    found = match(string, pos)
+                    if rule.__class__ is int:
+                        if found is None:
+                            break
+                        end = found.end()
+                    else:
+                        rules = rule
+                        end = pos
+                        for index, (lo, hi) in enumerate(found.regs[1:]):
+                            if hi > end:
+                                end = hi
+                                rule = rules[index]
+                    if end == pos:
+                        break
+                    if follow[codes[end]] and tail[codes[end - 1]] and viable(string, pos, end + 1):
+                        state = table.start
+                        i = pos
+                        while state >= 0:
+                            state = transitions[state + codes[i]]
+                            i += 1
+                        if i > length:
+                            break
+                    action = actions[rule]
+                if action is None:
+                    pos = end
+                    continue
+                self.begin = pos
+                self.pos = self.end = end
+                token = action(self)
+                if token.__class__ is Token:
+                    if token.offset is None:
+                        token.offset = pos
+                    token.id = self.terminals.get(token.type, -1)
+                pos = end
+                yield token
+            self.pos = pos
+            if not (yield from self.scan(1)):
+                return
+            pos = self.pos
+
+    def scan_lazy(self):
+        lazy = self.lazy
+        rows = lazy.rows
+        skip = self.transition_table.skip
+        actions = self.actions
+        codes = self.codes
+        length = len(self.string)
+        pos = self.pos
+        while True:
+            while skip[codes[pos]]:
+                pos += 1
+            begin = end = pos
+            state = 0
+            accepted = -1
+            while True:
+                target = rows[state + codes[pos]]
+                if target < 0:
+                    if target != -2:
+                        break
+                    target = lazy.step(state, codes[pos], self.base + pos)
+                    rows = lazy.rows
+                    if target < 0:
+                        break
+                pos += 1
+                state = target
+                if rows[state] != -1:
+                    accepted = -rows[state] - 3
+                    end = pos
+            if pos == length:
+                if self.chunks is not None:
+                    starved = self.refill(begin)
+                    codes = self.codes
+                    length = len(self.string)
+                    pos = 0
+                    if starved:
+                        yield STARVED
+                    continue
+                if pos == begin:
+                    break
+                if end != pos and self.err is not None:
+                    self.begin = begin
+                    self.pos = self.end = pos
+                    yield self.located(self.err(self))
+                    continue
+            if accepted < 0:
+                if pos == length:
+                    pos -= 1
+                self.begin = begin
+                self.end = pos + 1
+                self.pos = pos
+                res = self.error(self)
+                pos += 1
+                if res is not None:
+                    self.pos = pos
+                    yield self.located(res)
+                continue
+            pos = end
+            action = actions[accepted]
+            if action is None:
+                continue
+            self.begin = begin
+            self.pos = self.end = end
+            token = action(self)
+            if token.__class__ is Token:
+                if token.offset is None:
+                    token.offset = self.base + begin
+                token.id = self.terminals.get(token.type, -1)
+            yield token
+        self.begin = self.end = self.pos = pos
+        while self.eoffunc is not None and self.count > 0:
+            self.count -= 1
+            yield self.located(self.eoffunc(self))
@@ -1,25 +1,66 @@
 from lex import *
+import array
+import collections
+import concurrent.futures
+import functools
+import hashlib
+import itertools
+import mmap
+import os
+import pickle
+import re
+import string
+import struct
 import types
 import enum
+import warnings
+
+TABLE_VERSION = 2
 
 class Product:
-    def __init__(self, name, body, function = None):
+    def __init__(self, name, body, function = None, code = None):
         self.name = name
         self.body = body
         self.function = function
+        self.code = code
     def __str__(self):
         return f"{self.name} -> {' '.join(self.body)}"
     __repr__ = __str__
-    def _eq__(self, other):
+    def __eq__(self, other):
         return self.name == other.name and self.body == other.body
     def __hash__(self):
         return hash((self.name, tuple(self.body)))
+    def __getstate__(self):
+        """
+        Functions made by C.generate and Parser.pattern are pickled as their code and the wrapped callback.
+        """
+        state = self.__dict__.copy()
+        if self.code is not None:
+            state["function"] = None
+        elif hasattr(self.function, "__wrapped__"):
+            state["function"] = self.function.__wrapped__
+            state["wrapped"] = True
+        return state
+    def __setstate__(self, state):
+        wrapped = state.pop("wrapped", False)
+        self.__dict__.update(state)
+        if self.code is not None:
+            self.function = reducer(self.code)
+        elif wrapped:
+            self.function = wrapper(self.function)
+
+def reducer(code):
+    body = f"def fn(parser, args):\n    return {code}"
+    return types.FunctionType(compile(body, "", "exec").co_consts[0], {})
+
+def wrapper(func):
+    @functools.wraps(func)
+    def fn(parser, args):
+        return func(parser, *args)
+    return fn
 
 class Item:
-    STATUS = -1
     def __init__(self, product, pos, follow):
-        Item.STATUS += 1
-        self.status = Item.STATUS
         self.product = product
         self.pos = pos
         self.follow = follow
@@ -32,154 +73,443 @@ class Item:
         return hash((self.product, self.pos, self.follow))
 
 class State:
-    STATUS = -1
-    def __init__(self, items):
-        State.STATUS += 1
-        self.status = State.STATUS
+    def __init__(self, status, items):
+        self.status = status
         self.items = items
 
-def first(product, terminal, nonterminal):
-    if product == "ε":
-        return {"ε"}
-    if product[0] == "ε":
-        product = product[1:]
-    if product[-1] == "$":
-        product = product[:-1]
-    if not product:
-        return {"$"}
-    if product in terminal:
-        return {product}
-    if product not in nonterminal:
-        return {"ε"}
-    products = nonterminal[product]
-    first_set = set()
-    for product in products:
-        for term in product.body:
-            if term in terminal:
-                first_set.add(term)
-                break
-            if term != product.name:
-                term_set = first(term, terminal, nonterminal)
-                first_set.update(term_set - {"ε"})
-                if "ε" not in term_set:
+class Grammar:
+    """
+    The products of a Parser with nullable, FIRST and FOLLOW for every nonterminal, computed once by fixpoints.
+    Sets are frozensets of terminal names, str(grammar) lists them all and undefined holds the symbols
+    that are neither a terminal nor a nonterminal.
+    """
+    def __init__(self, terminal, nonterminal, start = "S"):
+        self.terminals = terminal if "$" in terminal else terminal + ["$"]
+        self.nonterminals = list(nonterminal)
+        self.products = [product for products in nonterminal.values() for product in products]
+        self.rules = {name: [] for name in nonterminal}
+        for index, product in enumerate(self.products):
+            self.rules[product.name].append(index)
+        self.symbols = {char: index for index, char in enumerate(self.terminals)}
+        for name in nonterminal:
+            self.symbols.setdefault(name, len(self.symbols))
+        self.undefined = []
+        for product in self.products:
+            for term in product.body:
+                if term not in self.symbols:
+                    self.symbols[term] = len(self.symbols)
+                    self.undefined.append(term)
+        bits = {char: 1 << index for index, char in enumerate(self.terminals)}
+        self.nullable = set()
+        first = {name: 0 for name in nonterminal}
+        changed = True
+        while changed:
+            changed = False
+            for product in self.products:
+                found = first[product.name]
+                for term in product.body:
+                    if term in first:
+                        found |= first[term]
+                        if term in self.nullable:
+                            continue
+                    elif term in bits:
+                        found |= bits[term]
                     break
-        else:
-            first_set.add("ε")
-    return first_set
-
-def follow(product, terminal, nonterminal):
-    follow_set = set()
-    if product == "S":
-        follow_set.add("$")
-    for name, experissions in nonterminal.items():
-        if name == product:
-            continue
-        for experission in experissions:
-            for index, term in enumerate(experission.body):
-                if term == product:
-                    if index != len(experission.body) - 1:
-                        first_set = first(experission.body[index+1], terminal, nonterminal)
-                        follow_set.update(first_set - {"ε"})
-                        if "ε" in first_set:
-                            follow_set.update(follow(name, terminal, nonterminal))
-                    else:
-                        follow_set.update(follow(name, terminal, nonterminal))
-    return follow_set
-
-def closure(items, terminal, nonterminal):
-    if not items:
-        return []
-    closure_set = [*items]
-    index = 0
-    next_ = closure_set[index]
-    while next_ and next_.pos < len(next_.product.body):
-        followed = next_.product.body[next_.pos]
-        if followed in nonterminal and next_.pos < len(next_.product.body):
-            terms = nonterminal[followed]
-            for term in terms:
-                next_char = next_.product.body[next_.pos + 1] if next_.pos + 1 < len(next_.product.body) else "ε"
-                for b in first(next_char + next_.follow, terminal, nonterminal):
-                    new_item = Item(term, 0, b)
-                    if new_item not in closure_set:
-                        closure_set.append(new_item)
-        index += 1
-        next_ = closure_set[index] if index < len(closure_set) else None
-    return closure_set
-
-def goto(items, char, terminal, nonterminal):
-    goto_set = []
-    for item in items:
-        if item.pos < len(item.product.body) and item.product.body[item.pos] == char:
-            new_item = Item(item.product, item.pos + 1, item.follow)
-            if new_item not in goto_set:
-                goto_set.append(new_item)
-    return closure(goto_set, terminal, nonterminal)
-
-def make_goto_table(terminal, nonterminal):
-    goto_table = {}
-    I0 = State(closure([Item(Product("S'", ["S"]), 0, "$")], terminal, nonterminal))
-    keys = terminal + list(nonterminal.keys())
-    state_list = [I0]
-    for state in state_list:
-        for char in keys:
-            goto_set = goto(state.items, char, terminal, nonterminal)
-            if goto_set:
-                for s in state_list:
-                    if s.items == goto_set:
-                        goto_table[(state.status, char)] = s.status
-                        break
                 else:
-                    new_state = State(goto_set)
-                    state_list.append(new_state)
-                    goto_table[(state.status, char)] = new_state.status
+                    if product.name not in self.nullable:
+                        self.nullable.add(product.name)
+                        changed = True
+                if found != first[product.name]:
+                    first[product.name] = found
+                    changed = True
+        self.first = {name: self.names(found) for name, found in first.items()}
+        self.sequences = {}
+        follow = {name: 0 for name in nonterminal}
+        if start in follow:
+            follow[start] = bits["$"]
+        changed = True
+        while changed:
+            changed = False
+            for product in self.products:
+                for pos, term in enumerate(product.body):
+                    if term not in follow:
+                        continue
+                    found, through = self.first_of(product.body[pos + 1:])
+                    found = follow[term] | sum(bits[char] for char in found)
+                    if through:
+                        found |= follow[product.name]
+                    if found != follow[term]:
+                        follow[term] = found
+                        changed = True
+        self.follow = {name: self.names(found) for name, found in follow.items()}
+    def names(self, found):
+        return frozenset(char for index, char in enumerate(self.terminals) if found >> index & 1)
+    def first_of(self, symbols):
+        """
+        (FIRST, nullable) of a sequence of symbols, memoized.
+        """
+        symbols = tuple(symbols)
+        if symbols not in self.sequences:
+            found = set()
+            for term in symbols:
+                if term in self.first:
+                    found |= self.first[term]
+                    if term in self.nullable:
+                        continue
+                elif term in self.symbols and self.symbols[term] < len(self.terminals):
+                    found.add(term)
+                break
+            else:
+                self.sequences[symbols] = frozenset(found), True
+                return self.sequences[symbols]
+            self.sequences[symbols] = frozenset(found), False
+        return self.sequences[symbols]
+    def __str__(self):
+        lines = []
+        for name in self.nonterminals:
+            nullable = " nullable" if name in self.nullable else ""
+            lines.append(f"{name}{nullable} FIRST {{{', '.join(sorted(self.first[name]))}}} FOLLOW {{{', '.join(sorted(self.follow[name]))}}}")
+        if self.undefined:
+            lines.append(f"undefined {', '.join(self.undefined)}")
+        return "\n".join(lines)
+
+def make_goto_table(grammar):
+    """
+    Canonical LR(1) states. An item is packed into one int, position * width + lookahead: positions number the dots
+    of all products one after another, lookaheads index the terminals. States are found by their kernel.
+    Every State keeps only its completed items, which is all make_action_table needs besides goto_table.
+    """
+    terminals = grammar.terminals
+    width = len(terminals)
+    symbols = grammar.symbols
+    names = list(symbols)
+    starts = {name: [] for name in grammar.rules}
+    at = []
+    heads = []
+    spontaneous = []
+    passes = []
+    reduce = []
+    for product in grammar.products:
+        starts[product.name].append(len(at))
+        for pos, term in enumerate(product.body):
+            found, through = grammar.first_of(product.body[pos + 1:])
+            at.append(symbols[term])
+            heads.append(term)
+            spontaneous.append(sorted(symbols[char] for char in found))
+            passes.append(through)
+            reduce.append(None)
+        at.append(-1)
+        heads.append(None)
+        spontaneous.append(None)
+        passes.append(None)
+        reduce.append(product)
+    heads = [[start * width for start in starts[head]] if head in starts else None for head in heads]
+    def closure(kernel):
+        items = set(kernel)
+        work = list(kernel)
+        while work:
+            pos, char = divmod(work.pop(), width)
+            bases = heads[pos]
+            if bases:
+                chars = spontaneous[pos] + [char] if passes[pos] else spontaneous[pos]
+                for base in bases:
+                    for follow in chars:
+                        if base + follow not in items:
+                            items.add(base + follow)
+                            work.append(base + follow)
+        return items
+    kernel = frozenset([starts["S'"][0] * width + symbols["$"]])
+    kernels = {kernel: 0}
+    states = [closure(kernel)]
+    goto_table = {}
+    state_list = []
+    for status, items in enumerate(states):
+        moves = {}
+        completed = []
+        for item in items:
+            pos = item // width
+            if at[pos] < 0:
+                completed.append(Item(reduce[pos], pos, terminals[item % width]))
+            else:
+                moves.setdefault(at[pos], []).append(item + width)
+        for symbol, kernel in moves.items():
+            kernel = frozenset(kernel)
+            target = kernels.get(kernel)
+            if target is None:
+                target = kernels[kernel] = len(states)
+                states.append(closure(kernel))
+            goto_table[(status, names[symbol])] = target
+        state_list.append(State(status, completed))
     return goto_table, state_list
 
-def make_action_table(terminal, priority, goto_table, state_list):
+def make_action_table(terminal, priority, goto_table, state_list, products):
+    """
+    Also returns the reduce/reduce conflicts as (state, terminal, products), the product that comes first in products wins.
+    """
     action_table = {}
     shift_reduce = []
-    shifts = {}
+    terminals = set(terminal)
+    rank = {id(product): index for index, product in enumerate(products)}
+    for (status, char), target in goto_table.items():
+        if char in terminals:
+            action_table[(status, char)] = ("SHIFT", target)
     reduces = {}
     for state in state_list:
         for item in state.items:
-            if item.pos < len(item.product.body):
-                for char in terminal:
-                    if (state.status, char) in goto_table:
-                        goto_state = goto_table[(state.status, char)]
-                        if (state.status, char) in action_table:
-                            action = action_table[(state.status, char)]
-                            if action[0] == "REDUCE":
-                                shift_reduce.append((state.status, char, item, reduces[(state.status, char)], ("SHIFT", goto_state), action))
-                                continue
-                        action_table[(state.status, char)] = ("SHIFT", goto_state)
-                        shifts[(state.status, char)] = item
-            elif item.product.name != "S'":
-                if (state.status, item.follow) in action_table:
-                    action = action_table[(state.status, item.follow)]
-                    if action[0] == "SHIFT":
-                        shift_reduce.append((state.status, item.follow, shifts[(state.status, item.follow), item, action, ("REDUCE", item.product)]))
-                        continue
-                action_table[(state.status, item.follow)] = ("REDUCE", item.product)
-                reduces[(state.status, item.follow)] = item
-            elif item.follow == "$":
-                action_table[(state.status, "$")] = ("ACCEPT", None)
-    for status, character, shift_item, reduce_item, shift_action, reduce_action in shift_reduce:
-        shift_priority, shift_associativity = priority.get(shift_item.product.body[shift_item.pos], None)
-        for term in reduce_item.product.body[::-1]:
-            if term in terminal:
-                reduce_priority, reduce_associativity = priority.get(term, None)
+            key = (state.status, item.follow)
+            if item.product.name == "S'":
+                action_table[key] = ("ACCEPT", None)
+                continue
+            found = reduces.setdefault(key, [])
+            if all(product is not item.product for product in found):
+                found.append(item.product)
+    conflicts = []
+    for key, found in reduces.items():
+        if len(found) > 1:
+            found.sort(key = lambda product: rank[id(product)])
+            conflicts.append((*key, found))
+        action = action_table.get(key)
+        if action is None:
+            action_table[key] = ("REDUCE", found[0])
+        elif action[0] == "SHIFT":
+            shift_reduce.append((*key, found[0], action, ("REDUCE", found[0])))
+    conflicts.sort(key = lambda conflict: (conflict[0], terminal.index(conflict[1])))
+    for status, character, reduce_product, shift_action, reduce_action in shift_reduce:
+        shift_priority, shift_associativity = priority.get(character, (None, None))
+        reduce_priority, reduce_associativity = None, None
+        for term in reduce_product.body[::-1]:
+            if term in terminals:
+                reduce_priority, reduce_associativity = priority.get(term, (None, None))
                 break
         if shift_priority is None or reduce_priority is None:
-            action_table[{status, character}] = shift_action
-        if shift_priority < reduce_priority:
+            action_table[(status, character)] = shift_action
+        elif shift_priority < reduce_priority:
             action_table[(status, character)] = shift_action
         elif shift_priority > reduce_priority:
             action_table[(status, character)] = reduce_action
         else:
             if shift_associativity == "LEFT" and reduce_associativity == "LEFT":
-                action_table[(status, character)] = shift_action
-            elif shift_associativity == "RIGHT" and reduce_associativity == "RIGHT":
                 action_table[(status, character)] = reduce_action
-    return action_table
+            elif shift_associativity == "RIGHT" and reduce_associativity == "RIGHT":
+                action_table[(status, character)] = shift_action
+    return action_table, conflicts
+
+def merged_conflicts(grammar, goto_table, conflicts):
+    """
+    Tells for every reduce/reduce conflict of the LALR states in goto_table whether the merge made it: no canonical
+    LR(1) state with that core reduces by two of its products on its terminal. Returns (state, terminal, products, merged).
+    """
+    lr1_goto_table, lr1_states = make_goto_table(grammar)
+    core = {0: 0}
+    for (state, char), target in sorted(lr1_goto_table.items()):
+        core.setdefault(target, goto_table[(core[state], char)])
+    found = {}
+    for state in lr1_states:
+        for item in state.items:
+            found.setdefault((core[state.status], item.follow), {}).setdefault(id(item.product), set()).add(state.status)
+    result = []
+    for state, char, products in conflicts:
+        owners = collections.Counter(owner for product in products for owner in found[(state, char)].get(id(product), ()))
+        result.append((state, char, products, not any(count > 1 for count in owners.values())))
+    return result
+
+def digraph(nodes, relation, sets):
+    """
+    DeRemer and Pennello's digraph: every sets[x] gets the union of sets[y] over all y reachable from x.
+    Sets are int bitsets, relation maps a node to the nodes it points at.
+    """
+    depth = {}
+    stack = []
+    for root in nodes:
+        if root in depth:
+            continue
+        stack.append(root)
+        depth[root] = len(stack)
+        work = [(root, len(stack), iter(relation.get(root, ())))]
+        while work:
+            node, low, edges = work[-1]
+            for target in edges:
+                if target not in depth:
+                    stack.append(target)
+                    depth[target] = len(stack)
+                    work.append((target, len(stack), iter(relation.get(target, ()))))
+                    break
+                depth[node] = min(depth[node], depth[target])
+                sets[node] |= sets[target]
+            else:
+                work.pop()
+                if depth[node] == low:
+                    while True:
+                        top = stack.pop()
+                        depth[top] = len(nodes) + 1
+                        sets[top] = sets[node]
+                        if top == node:
+                            break
+                if work:
+                    parent = work[-1][0]
+                    depth[parent] = min(depth[parent], depth[node])
+                    sets[parent] |= sets[node]
+    return sets
+
+def make_lalr_table(grammar):
+    """
+    LR(0) states with LALR(1) lookaheads after DeRemer and Pennello, in the form make_goto_table returns.
+    """
+    products = grammar.products
+    rules = grammar.rules
+    nullable = grammar.nullable
+    start = rules["S'"][0]
+    terminals = grammar.terminals
+    bits = {char: 1 << index for index, char in enumerate(terminals)}
+    def closure(kernel):
+        items = list(kernel)
+        seen = set(kernel)
+        for index, pos in items:
+            body = products[index].body
+            if pos < len(body) and body[pos] in rules:
+                for rule in rules[body[pos]]:
+                    if (rule, 0) not in seen:
+                        seen.add((rule, 0))
+                        items.append((rule, 0))
+        return items
+    kernels = {frozenset([(start, 0)]): 0}
+    states = [closure([(start, 0)])]
+    transitions = []
+    for items in states:
+        moves = {}
+        for index, pos in items:
+            body = products[index].body
+            if pos < len(body):
+                moves.setdefault(body[pos], []).append((index, pos + 1))
+        targets = {}
+        for char, kernel in moves.items():
+            kernel = frozenset(kernel)
+            if kernel not in kernels:
+                kernels[kernel] = len(states)
+                states.append(closure(kernel))
+            targets[char] = kernels[kernel]
+        transitions.append(targets)
+    nodes = [(state, char) for state, targets in enumerate(transitions) for char in targets if char in rules]
+    sets = {}
+    reads = {}
+    for state, char in nodes:
+        target = transitions[state][char]
+        sets[(state, char)] = sum(bits[term] for term in transitions[target] if term in bits)
+        reads[(state, char)] = [(target, term) for term in transitions[target] if term in nullable]
+    sets[(0, "S")] |= bits["$"]
+    digraph(nodes, reads, sets)
+    includes = {}
+    lookback = {}
+    for state, char in nodes:
+        for rule in rules[char]:
+            body = products[rule].body
+            current = state
+            for pos, term in enumerate(body):
+                if term in rules and all(rest in nullable for rest in body[pos + 1:]):
+                    includes.setdefault((current, term), []).append((state, char))
+                current = transitions[current][term]
+            lookback.setdefault((current, rule), []).append((state, char))
+    digraph(nodes, includes, sets)
+    lookahead = {key: 0 for key in lookback}
+    for key, sources in lookback.items():
+        for source in sources:
+            lookahead[key] |= sets[source]
+    lookahead[(transitions[0]["S"], start)] = bits["$"]
+    state_list = []
+    for state, items in enumerate(states):
+        entries = []
+        for index, pos in items:
+            product = products[index]
+            if pos < len(product.body):
+                continue
+            for char in terminals:
+                if lookahead.get((state, index), 0) & bits[char]:
+                    entries.append(Item(product, pos, char))
+        state_list.append(State(state, entries))
+    goto_table = {(state, char): target for state, targets in enumerate(transitions) for char, target in targets.items()}
+    return goto_table, state_list
+
+class ParseTable:
+    """
+    action_table and goto_table as flat int arrays. actions has a row of width entries per state, one column per
+    terminal and a last one for unknown token types: target + 1 shifts, -(product + 1) reduces and 0 is an error,
+    reducing by accept accepts. gotos has a row of len(nonterminals) entries per state.
+    A saved table is a header followed by actions, gotos and the conflicts as native ints, load maps it read-only
+    so processes loading the same file share it. Products are matched by index, their functions are the current ones.
+    """
+    header = struct.Struct("8s64s6i")
+    def __init__(self, grammar):
+        self.terminals = grammar.terminals
+        self.ids = {char: index for index, char in enumerate(self.terminals)}
+        self.width = len(self.terminals) + 1
+        self.nonterminals = grammar.nonterminals
+        self.products = grammar.products
+        self.lefts = array.array("i", [self.nonterminals.index(product.name) for product in self.products])
+        self.lengths = array.array("i", [len(product.body) for product in self.products])
+        self.accept = grammar.rules["S'"][0]
+        self.conflicts = []
+    def fill(self, action_table, goto_table, count, conflicts = ()):
+        indices = {id(product): index for index, product in enumerate(self.products)}
+        self.count = count
+        self.actions = array.array("i", bytes(4 * count * self.width))
+        for (status, char), (action, arg) in action_table.items():
+            if action == "SHIFT":
+                self.actions[status * self.width + self.ids[char]] = arg + 1
+            elif action == "REDUCE":
+                self.actions[status * self.width + self.ids[char]] = -indices[id(arg)] - 1
+            else:
+                self.actions[status * self.width + self.ids[char]] = -self.accept - 1
+        nonterminals = {name: index for index, name in enumerate(self.nonterminals)}
+        self.gotos = array.array("i", bytes(4 * count * len(nonterminals)))
+        for (status, char), target in goto_table.items():
+            if char in nonterminals:
+                self.gotos[status * len(nonterminals) + nonterminals[char]] = target
+        self.conflicts = [(state, char, [indices[id(product)] for product in products], merged) for state, char, products, merged in conflicts]
+    def save(self, path, fingerprint):
+        conflicts = array.array("i")
+        for state, char, products, merged in self.conflicts:
+            conflicts.extend([state, self.ids[char], int(merged), len(products), *products])
+        temp = f"{path}.{os.getpid()}.tmp"
+        with open(temp, "wb") as f:
+            f.write(self.header.pack(b"PLPGLR\0\0", fingerprint.encode(), TABLE_VERSION, self.count, self.width, len(self.nonterminals), len(self.products), len(conflicts)))
+            f.write(self.actions.tobytes())
+            f.write(self.gotos.tobytes())
+            f.write(conflicts.tobytes())
+        os.replace(temp, path)
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["actions"] = array.array("i", self.actions.tobytes())
+        state["gotos"] = array.array("i", self.gotos.tobytes())
+        return state
+    @staticmethod
+    def load(path, fingerprint, grammar):
+        try:
+            with open(path, "rb") as f:
+                data = mmap.mmap(f.fileno(), 0, access = mmap.ACCESS_READ)
+            table = ParseTable(grammar)
+            magic, found, version, count, width, height, products, size = table.header.unpack_from(data)
+            if (magic, found, version) != (b"PLPGLR\0\0", fingerprint.encode(), TABLE_VERSION):
+                return None
+            if (width, height, products) != (table.width, len(table.nonterminals), len(table.products)):
+                return None
+            if len(data) != table.header.size + 4 * (count * (width + height) + size):
+                return None
+            ints = memoryview(data)[table.header.size:].cast("i")
+            table.count = count
+            table.actions = ints[:count * width]
+            table.gotos = ints[count * width:count * (width + height)]
+            if not -products <= min(table.actions, default = 0) <= max(table.actions, default = 0) <= count:
+                return None
+            if not 0 <= min(table.gotos, default = 0) <= max(table.gotos, default = 0) < count:
+                return None
+            conflicts = ints[count * (width + height):].tolist()
+            while conflicts:
+                state, char, merged, size = conflicts[:4]
+                table.conflicts.append((state, table.terminals[char], conflicts[4:4 + size], bool(merged)))
+                del conflicts[:4 + size]
+            return table
+        except Exception:
+            return None
 
 class C: # Combinator
     List = []
@@ -258,9 +588,8 @@ class C: # Combinator
                             rets.append(f"args[{m}]")
                 else:
                     raise ValueError(f"Invalid option: {option}")
-                body = f"def fn(parser, args):\n    return [{','.join(rets)}]"
-                fn = types.FunctionType(compile(body, "", "exec").co_consts[0], {})
-                res[id_].append(Product(id_, b, fn))
+                code = f"[{','.join(rets)}]"
+                res[id_].append(Product(id_, b, reducer(code), code))
         C.List = []
         return res
 
@@ -417,20 +746,166 @@ class Analyzer:
         expr = self.expr()
         return name, expr
 
+class Node:
+    __slots__ = ("name", "children")
+    def __init__(self, name, children):
+        self.name = name
+        self.children = children
+    def __str__(self):
+        return f"{self.name}({', '.join(map(str, self.children))})"
+    __repr__ = __str__
+
+class Tree:
+    """
+    Derivation from Parser.parse(mode = "tree") in postfix order: codes has a token index for every shift
+    and -(product + 1) for every reduction, tokens is a TokenBuffer of the tokens read.
+    Iterating gives the Tokens and Products in that order, root builds the Nodes.
+    """
+    def __init__(self, products, tokens, codes):
+        self.products = products
+        self.tokens = tokens
+        self.codes = codes
+    def __len__(self):
+        return len(self.codes)
+    def __iter__(self):
+        for code in self.codes:
+            yield self.tokens[code] if code >= 0 else self.products[-code - 1]
+    def root(self):
+        """
+        Nested Nodes with Tokens as leaves, the products C.generate made are spliced into their parent.
+        """
+        products, tokens = self.products, self.tokens
+        stack = []
+        for code in self.codes:
+            if code >= 0:
+                stack.append(tokens[code])
+                continue
+            product = products[-code - 1]
+            start = len(stack) - len(product.body)
+            children = []
+            for child in stack[start:]:
+                if child.__class__ is list:
+                    children += child
+                else:
+                    children.append(child)
+            del stack[start:]
+            stack.append(children if product.code is not None else Node(product.name, children))
+        return stack[-1] if stack else None
+
+worker_parser = None
+
+def start_parser_worker(lexer, parser):
+    global worker_parser
+    parser.read(lexer)
+    worker_parser = parser
+
+def parse_batch(start, texts):
+    """
+    Worker side of Parser.parse_many, (index, value, error) for every text.
+    """
+    parser = worker_parser
+    results = []
+    for index, text in enumerate(texts, start):
+        try:
+            parser.lexer.read(text)
+            results.append((index, parser.parse(), None))
+        except Exception as error:
+            try:
+                pickle.loads(pickle.dumps(error))
+            except Exception:
+                error = Exception(f"{type(error).__name__}: {error}")
+            results.append((index, None, error))
+    return results
+
+GENERATED_PARSER = string.Template("""\
+# Generated by PLPG Parser.generate, do not edit.
+$imports
+
+TERMINALS = $terminals
+IDS = {char: index for index, char in enumerate(TERMINALS)}
+WIDTH = $width
+HEIGHT = $height
+ACCEPT = $accept
+ACTIONS = $actions
+GOTOS = $gotos
+LEFTS = $lefts
+LENGTHS = $lengths
+
+$reducers
+
+REDUCERS = $table
+
+class Parser:
+    def __init__(self):
+        self.err = $err
+
+    def error(self, func):
+        self.err = func
+        return func
+
+    def read(self, lexer):
+        self.lexer = lexer
+        lexer.terminals = IDS
+
+    def parse(self):
+        lex = self.lexer.lex
+        self.lexer.terminals = IDS
+        self.value_stack = values = []
+        self.state_stack = states = [0]
+        push = states.append
+        self.index = 0
+        state = 0
+        token = lex()
+        char = getattr(token, "id", -1)
+        if char < 0:
+            char = IDS.get(token.type, WIDTH - 1)
+        while True:
+            action = ACTIONS[state * WIDTH + char]
+            if action > 0:
+                state = action - 1
+                push(state)
+                values.append(token)
+                token = lex()
+                char = getattr(token, "id", -1)
+                if char < 0:
+                    char = IDS.get(token.type, WIDTH - 1)
+                self.index += 1
+            elif action == ACCEPT:
+                break
+            elif action < 0:
+                rule = -action - 1
+                count = LENGTHS[rule]
+                if count:
+                    del states[-count:]
+                reducer = REDUCERS[rule]
+                if reducer is not None:
+                    reducer(self, values)
+                state = GOTOS[states[-1] * HEIGHT + LEFTS[rule]]
+                push(state)
+            else:
+                self.token = token
+                self.tp = token.type
+                self.state = state
+                self.err(self)
+                break
+        return values.pop()
+""")
+
 class Parser:
     def __init__(self):
         self.terminals = []
         self.priorities = {}
         self.patterns = {}
+        self.options = []
+        self.feeding = False
 
     def pattern(self, text, option = "ALL"):
         def decorator(func):
             name, pattern = Analyzer(Scanner(text)).product()
             patterns = pattern.generate(self.terminals, option)
             id_ = str(pattern.id)
-            def fn(parser, args):
-                return func(parser, *args)
-            patterns[name] = [Product(name, [id_], fn)]
+            patterns[name] = [Product(name, [id_], wrapper(func))]
+            self.options.append((text, option))
             for k, v in patterns.items():
                 if k in self.patterns:
                     self.patterns[k] += v
@@ -443,50 +918,341 @@ class Parser:
         self.err = func
         return func
 
-    def compile(self):
+    def fingerprint(self, mode):
+        """
+        The nonterminals C.generate numbers from a counter shared by all parsers are renumbered in order of appearance.
+        """
+        renamed = {}
+        def name(term):
+            return renamed.setdefault(term, f"#{len(renamed)}") if term.isdigit() and term in self.patterns else term
+        products = [(name(product.name), [name(term) for term in product.body]) for product in self.grammar.products]
+        return hashlib.sha256(repr((TABLE_VERSION, mode, self.grammar.terminals, products, self.options, sorted(self.priorities.items()))).encode()).hexdigest()
+
+    def compile(self, mode = "lr1", cache = None):
+        """
+        mode "lr1" builds canonical LR(1) states, "lalr" merges them to the LR(0) states (see make_lalr_table).
+        Reduce/reduce conflicts are warned about and kept in self.conflicts as (state, terminal, products, merged),
+        the first product wins and merged tells the ones the LALR merge made (see merged_conflicts).
+        With cache the table is loaded from that file when it was saved for the same grammar, or saved there.
+        A loaded parser has no action_table and goto_table, only self.table.
+        """
+        if mode not in ("lr1", "lalr"):
+            raise ValueError(f"Unknown mode {mode!r}")
         self.patterns["S'"] = [Product("S'", ["S"], None)]
-        self.goto_table, state_list = make_goto_table(self.terminals, self.patterns)
-        self.action_table = make_action_table(self.terminals, self.priorities, self.goto_table, state_list)
+        self.grammar = Grammar(self.terminals, self.patterns)
+        self.table = self.action_table = self.goto_table = None
+        if cache is not None:
+            self.table = ParseTable.load(cache, self.fingerprint(mode), self.grammar)
+        if self.table is None:
+            if mode == "lalr":
+                self.goto_table, state_list = make_lalr_table(self.grammar)
+            else:
+                self.goto_table, state_list = make_goto_table(self.grammar)
+            self.action_table, conflicts = make_action_table(self.grammar.terminals, self.priorities, self.goto_table, state_list, self.grammar.products)
+            if mode == "lalr" and conflicts:
+                conflicts = merged_conflicts(self.grammar, self.goto_table, conflicts)
+            else:
+                conflicts = [(state, char, products, False) for state, char, products in conflicts]
+            self.table = ParseTable(self.grammar)
+            self.table.fill(self.action_table, self.goto_table, len(state_list), conflicts)
+            if cache is not None:
+                try:
+                    self.table.save(cache, self.fingerprint(mode))
+                except OSError:
+                    pass
+        products = self.grammar.products
+        self.conflicts = [(state, char, [products[index] for index in found], merged) for state, char, found, merged in self.table.conflicts]
+        for state, char, found, merged in self.conflicts:
+            warnings.warn(f"Reduce/reduce conflict in state {state} on {char}: {', '.join(map(str, found))}{' (made by the LALR merge)' if merged else ''}")
+
+    def generate(self, path):
+        """
+        Writes a module with the tables and a Parser that only needs the callbacks, which have to be importable by name.
+        The list building of C.generate is written out in the reducers, the functions given to pattern are called directly.
+        """
+        table = self.table
+        modules = {}
+        def reference(function):
+            module = getattr(function, "__module__", None)
+            name = getattr(function, "__qualname__", "")
+            if module is None or not name or "<" in name:
+                raise ValueError(f"Callback {qualname(function)} can not be imported by name")
+            modules.setdefault(module, f"_{len(modules)}")
+            return f"{modules[module]}.{name}"
+        reducers = {}
+        names = []
+        for product in table.products:
+            count = len(product.body)
+            if product.function is None:
+                names.append("None")
+                continue
+            if product.code is not None:
+                value = re.sub(r"args\[(\d+)\]", lambda match: f"values[{int(match[1]) - count}]", product.code)
+            elif hasattr(product.function, "__wrapped__"):
+                value = f"{reference(product.function.__wrapped__)}(parser, {'values[-1]' if count == 1 else f'*values[-{count}:]' if count else ''})"
+            else:
+                value = f"{reference(product.function)}(parser, {f'values[-{count}:]' if count else '[]'})"
+            if count == 0:
+                line = f"values.append({value})"
+            elif count == 1:
+                line = f"values[-1] = {value}"
+            else:
+                line = f"values[-{count}:] = [{value}]"
+            names.append(reducers.setdefault(line, f"reduce_{len(reducers)}"))
+        source = GENERATED_PARSER.substitute(
+            imports = "\n".join(f"import {module} as {alias}" for module, alias in modules.items()),
+            terminals = repr(table.terminals),
+            width = table.width,
+            height = len(table.nonterminals),
+            accept = -table.accept - 1,
+            actions = repr(tuple(table.actions)),
+            gotos = repr(tuple(table.gotos)),
+            lefts = repr(tuple(table.lefts)),
+            lengths = repr(tuple(table.lengths)),
+            reducers = "\n\n".join(f"def {name}(parser, values):\n    {line}" for line, name in reducers.items()),
+            table = "(" + "".join(f"{name}, " for name in names) + ")",
+            err = reference(self.err) if hasattr(self, "err") else "None",
+        )
+        with open(path, "w", encoding = "utf-8") as f:
+            f.write(source)
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        for name in ("lexer", "value_stack", "state_stack", "token", "result"):
+            state.pop(name, None)
+        state["feeding"] = False
+        return state
+
+    def parse_many(self, texts, workers = None, chunksize = 64, ordered = True):
+        """
+        Parses every text of the iterable texts with the lexer given to read on a pool of workers processes,
+        which get the lexer and this parser pickled once. Yields (index, value, error) per text, error is None
+        or what the parse raised. ordered False yields batches as they are done.
+        """
+        workers = workers or os.cpu_count() or 1
+        texts = iter(texts)
+        batches = iter(lambda: list(itertools.islice(texts, chunksize)), [])
+        with concurrent.futures.ProcessPoolExecutor(workers, initializer = start_parser_worker, initargs = (self.lexer, self)) as pool:
+            futures = collections.deque() if ordered else set()
+            start = 0
+            for batch in batches:
+                future = pool.submit(parse_batch, start, batch)
+                start += len(batch)
+                if ordered:
+                    futures.append(future)
+                    if len(futures) > 2 * workers:
+                        yield from futures.popleft().result()
+                else:
+                    futures.add(future)
+                    if len(futures) > 2 * workers:
+                        done, futures = concurrent.futures.wait(futures, return_when = concurrent.futures.FIRST_COMPLETED)
+                        for future in done:
+                            yield from future.result()
+            if ordered:
+                while futures:
+                    yield from futures.popleft().result()
+            else:
+                for future in concurrent.futures.as_completed(futures):
+                    yield from future.result()
 
     def read(self, lexer):
         self.lexer = lexer
+        lexer.terminals = self.table.ids
 
-    def parse(self):
-        self.value_stack = []
-        self.state_stack = [0]
+    def parse(self, mode = "values"):
+        """
+        mode "tree" runs no callbacks and returns the derivation as a Tree.
+        """
+        if mode == "tree":
+            return self.parse_tree()
+        if mode != "values":
+            raise ValueError(f"Unknown mode {mode!r}")
+        table = self.table
+        actions, gotos, width, height = table.actions, table.gotos, table.width, len(table.nonterminals)
+        ids, unknown = table.ids, len(table.terminals)
+        lefts, lengths, accept = table.lefts, table.lengths, -table.accept - 1
+        functions = [product.function for product in table.products]
+        lex = self.lexer.lex
+        self.lexer.terminals = ids
+        self.value_stack = values = []
+        self.state_stack = states = [0]
+        push, store = states.append, values.append
         self.index = 0
-        self.token = self.lexer.lex()
-        self.tp = self.token.type
-        goto_table = self.goto_table
-        action_table = self.action_table
+        state = 0
+        token = lex()
+        char = getattr(token, "id", -1)
+        if char < 0:
+            char = ids.get(token.type, unknown)
         while True:
-            self.state = self.state_stack[-1]
-            if (self.state, self.tp) in action_table:
-                action, arg = action_table[(self.state, self.tp)]
-            elif (self.state, self.tp) in goto_table:
-                self.state_stack.append(goto_table[(self.state, self.tp)])
-                self.tp = self.token.type
-                continue
-            elif (self.state, "ε") in action_table:
-                action, arg = action_table[(self.state, "ε")]
+            action = actions[state * width + char]
+            if action > 0:
+                state = action - 1
+                push(state)
+                store(token)
+                token = lex()
+                char = getattr(token, "id", -1)
+                if char < 0:
+                    char = ids.get(token.type, unknown)
+                self.index += 1
+            elif action == accept:
+                break
+            elif action < 0:
+                rule = -action - 1
+                count = lengths[rule]
+                function = functions[rule]
+                if count:
+                    del states[-count:]
+                    if function is not None:
+                        args = values[-count:]
+                        del values[-count:]
+                        store(function(self, args))
+                elif function is not None:
+                    store(function(self, []))
+                state = gotos[states[-1] * height + lefts[rule]]
+                push(state)
             else:
+                self.token = token
+                self.tp = token.type
+                self.state = state
                 self.err(self)
                 break
-            if action == "SHIFT":
-                self.state_stack.append(arg)
-                self.index += 1
-                self.value_stack.append(self.token)
-                self.token = self.lexer.lex()
-                self.tp = self.token.type
-            elif action == "REDUCE":
-                num = len(arg.body)
-                for _ in range(num):
-                    self.state_stack.pop()
-                if arg.function:
-                    args = [self.value_stack.pop() for _ in range(num)][::-1]
-                    res = arg.function(self, args)
-                    self.value_stack.append(res)
-                self.tp = arg.name
-            elif action == "ACCEPT":
+        return values.pop()
+
+    def parse_tree(self):
+        """
+        parse without callbacks, the tokens go straight into the columns of a TokenBuffer whose type ids are
+        the terminal ids.
+        """
+        table = self.table
+        actions, gotos, width, height = table.actions, table.gotos, table.width, len(table.nonterminals)
+        ids, unknown = table.ids, len(table.terminals)
+        lefts, lengths, accept = table.lefts, table.lengths, -table.accept - 1
+        lexer = self.lexer
+        lex = lexer.lex
+        lexer.terminals = ids
+        tokens = TokenBuffer()
+        for name in table.terminals:
+            tokens.intern(name)
+        types, starts, ends, refs, values = tokens.types.append, tokens.starts.append, tokens.ends.append, tokens.refs.append, tokens.values
+        codes = array.array("i")
+        emit = codes.append
+        self.value_stack = []
+        self.state_stack = states = [0]
+        push = states.append
+        index = 0
+        state = 0
+        token = lex()
+        tokens.append(token, *lexer.span)
+        char = getattr(token, "id", -1)
+        if char < 0:
+            char = ids.get(token.type, unknown)
+        while True:
+            action = actions[state * width + char]
+            if action > 0:
+                state = action - 1
+                push(state)
+                emit(index)
+                index += 1
+                token = lex()
+                char = getattr(token, "id", -1)
+                if char < 0:
+                    char = ids.get(token.type, unknown)
+                if char == unknown:
+                    tokens.append(token, *lexer.span)
+                    continue
+                types(char)
+                start, end = lexer.span
+                starts(start)
+                ends(end)
+                if token.value is None:
+                    refs(-1)
+                else:
+                    refs(len(values) - 1)
+                    values.append(token.value)
+            elif action == accept:
+                break
+            elif action < 0:
+                emit(action)
+                count = lengths[-action - 1]
+                if count:
+                    del states[-count:]
+                state = gotos[states[-1] * height + lefts[-action - 1]]
+                push(state)
+            else:
+                self.index = index
+                self.token = token
+                self.tp = token.type
+                self.state = state
+                self.err(self)
                 break
-        return self.value_stack.pop()
+        self.index = index
+        return Tree(table.products, tokens, codes)
+
+    def feed(self, token):
+        """
+        Push counterpart of parse: does the reductions token allows, shifts it and returns.
+        The first token starts a parse, a "$" token accepts it and finish hands out the value, tokens after that are dropped.
+        """
+        if self.feeding and self.accepted:
+            return
+        table = self.table
+        actions, gotos, width, height = table.actions, table.gotos, table.width, len(table.nonterminals)
+        if not self.feeding:
+            self.value_stack = []
+            self.state_stack = [0]
+            self.index = 0
+            self.feeding = True
+            self.accepted = False
+        values, states = self.value_stack, self.state_stack
+        char = table.ids.get(token.type, len(table.terminals))
+        try:
+            while not self.accepted:
+                action = actions[states[-1] * width + char]
+                if action > 0:
+                    states.append(action - 1)
+                    values.append(token)
+                    self.index += 1
+                    return
+                elif action == -table.accept - 1:
+                    self.accepted = True
+                    self.result = values.pop()
+                    return
+                elif action < 0:
+                    rule = -action - 1
+                    count = table.lengths[rule]
+                    function = table.products[rule].function
+                    if count:
+                        del states[-count:]
+                        if function is not None:
+                            args = values[-count:]
+                            del values[-count:]
+                            values.append(function(self, args))
+                    elif function is not None:
+                        values.append(function(self, []))
+                    states.append(gotos[states[-1] * height + table.lefts[rule]])
+                else:
+                    break
+        except BaseException:
+            self.feeding = False
+            raise
+        self.token = token
+        self.tp = token.type
+        self.state = states[-1]
+        self.feeding = False
+        self.err(self)
+
+    def finish(self):
+        """
+        Feeds "$" unless the lexer did and returns the value of the parse, None if there is none.
+        An error ends a parse as well, the next feed starts a new one, and so does an exception out of a callback.
+        """
+        if self.feeding and not self.accepted:
+            self.feed(Token("$", None))
+        accepted, self.feeding = self.feeding and self.accepted, False
+        return self.result if accepted else None
+
+    def reset(self):
+        """
+        Drops the parse feed has going, the next feed starts a new one.
+        """
+        self.feeding = False
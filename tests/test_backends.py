@@ -0,0 +1,87 @@
+import random
+
+import pytest
+
+import lex
+
+SPECS = {
+    "json": ([",|:|\\{|\\}|\\[|\\]", "\\-?[0-9](\\.[0-9][0-9]*)?", '"[^"]*"', "true|false|null"], [" ", "\n", "\t"], ' ,:{}[]-0123456789."abtruefalsn\n'),
+    "json2": ([",|:|\\{|\\}|\\[|\\]", "\\-?[0-9]+(\\.[0-9]+)?", '"([^"\\\\]|\\\\.)*"', "true|false|null"], [" ", "\n", "\t"], ' ,:{}[]-0123456789."\\abtruefalsn\n'),
+    "keywords": (["if|else|while|int", "[a-zA-Z_][a-zA-Z0-9_]*", "[0-9]+", "==|=|\\+|\\-|\\*|/|<=|<", "\\(|\\)|;"], [" "], "ifelswhntabxyz_019 =+-*/<();"),
+    "star": (["a*b", "(ab)+c?", "a|ba?", "c[a-c]*d"], [], "abcd"),
+    "overlap": (["ab|abcd", "b[cd]*", "[a-d]", "da?c"], [], "abcd"),
+    "nested": (["(a(bc)*)+d?", "(b|c)+a", "a?b?c", "[ab]"], ["d"], "abcd"),
+    "comment": (["/\\*([^*]|\\*+[^*/])*\\*+/", "/", "\\*", "[a-z]+"], [" "], "/*ab "),
+    "unicode": (["[α-ω]+", "[^α-ω ]", "😀+"], [" "], "αβω xy😀"),
+    "strings": (['"[^"]*"', "'[^']*'", "[a-c]+", "\\."], [" "], "\"'abc. "),
+    "optional": (["ab?c?d", "a", "bc", "(ab|c)*d"], [], "abcd"),
+}
+
+def make_lexer(patterns, ignore, backend, handlers, **options):
+    lexer = lex.Lexer()
+    lexer.ignore = ignore
+    for index, pattern in enumerate(patterns):
+        lexer.pattern(pattern)(lambda lexer, index = index: lex.Token(index, (lexer.buffer, lexer.span)))
+    lexer.eof(2)(lambda lexer: lex.Token("$", lexer.span))
+    if handlers & 1:
+        lexer.undefined(lambda lexer: lex.Token("undefined", lexer.buffer))
+    else:
+        lexer.undefined(lambda lexer: None)
+    if handlers & 2:
+        lexer.unclosed(lambda lexer: lex.Token("unclosed", lexer.buffer))
+    lexer.compile(backend = backend, **options)
+    return lexer
+
+@pytest.mark.parametrize("name", sorted(SPECS))
+def test_re_matches_dfa(name):
+    patterns, ignore, alphabet = SPECS[name]
+    rnd = random.Random(name)
+    for handlers in range(4):
+        dfa = make_lexer(patterns, ignore, "dfa", handlers)
+        regex = make_lexer(patterns, ignore, "re", handlers)
+        for _ in range(200):
+            text = "".join(rnd.choice(alphabet) for _ in range(rnd.randint(0, 30)))
+            expected = [(token.type, token.value, token.offset) for token in dfa.tokenize(text)]
+            assert [(token.type, token.value, token.offset) for token in regex.tokenize(text)] == expected, text
+
+@pytest.mark.parametrize("name", ["json", "json2", "keywords", "unicode", "strings"])
+def test_re_backend_is_used(name):
+    patterns, ignore, alphabet = SPECS[name]
+    assert make_lexer(patterns, ignore, "re", 3).backend == "re"
+
+def test_inexact_rule_goes_through_dfa():
+    patterns, ignore, alphabet = SPECS["json"]
+    lexer = make_lexer(patterns, ignore, "re", 3)
+    assert lexer.transition_table.inexact == (1,)
+    assert [token.value[0] for token in lexer.tokenize("[191, 1.25]")][:-2] == ["[", "191", ",", "1.25", "]"]
+
+def test_dfa_takes_one_token_at_a_time():
+    patterns, ignore, alphabet = SPECS["json"]
+    lexer = make_lexer(patterns, ignore, "re", 3)
+    scan = lexer.scan
+    turns = []
+    lexer.scan = lambda *args: turns.append(args) or scan(*args)
+    text = '[1, %, "a", 2.5, %]'
+    assert [token.value[0] for token in lexer.tokenize(text)][:-2] == ["[", "1", ",", "%", ",", '"a"', ",", "2.5", ",", "%", "]"]
+    assert turns == [(1,)] * 3
+
+@pytest.mark.parametrize("name", sorted(SPECS))
+@pytest.mark.parametrize("max_states", [1, 3, 10000])
+def test_lazy_matches_dfa(name, max_states):
+    patterns, ignore, alphabet = SPECS[name]
+    dfa = make_lexer(patterns, ignore, "dfa", 3)
+    if dfa.transition_table.inexact:
+        return
+    lexer = make_lexer(patterns, ignore, "lazy", 3, max_states = max_states)
+    rnd = random.Random(name)
+    for size in (3000, 20, 3000):
+        text = "".join(rnd.choice(alphabet) for _ in range(size))
+        expected = [(token.type, token.value) for token in dfa.tokenize(text)]
+        assert [(token.type, token.value) for token in lexer.tokenize(text)] == expected
+        assert lexer.lazy.flushed is None or lexer.lazy.flushed <= size
+
+def test_lazy_warns_about_cache(tmp_path):
+    patterns, ignore, alphabet = SPECS["star"]
+    with pytest.warns(UserWarning):
+        make_lexer(patterns, ignore, "lazy", 3, cache = tmp_path / "table")
+    assert not (tmp_path / "table").exists()
@@ -0,0 +1,25 @@
+import lex
+
+def token(kind):
+    def make(lexer):
+        return lex.Token(kind, lexer.buffer)
+    return make
+
+def tokens(lexer, text):
+    return [(token.type, token.value) for token in lexer.tokenize(text)][:-1]
+
+def make_lexer(callbacks, cache):
+    lexer = lex.Lexer()
+    lexer.pattern("[0-9]+")(callbacks[0])
+    lexer.pattern("[a-z]+")(callbacks[1])
+    lexer.eof()(lambda lexer: lex.Token("$", None))
+    lexer.compile(cache = cache)
+    return lexer
+
+def test_shared_callbacks_are_part_of_the_key(tmp_path):
+    cache = tmp_path / "lexer.cache"
+    shared = token("num")
+    assert tokens(make_lexer([shared, shared], cache), "12ab") == [("num", "12ab")]
+    separate = make_lexer([token("num"), token("id")], cache)
+    assert tokens(separate, "12ab") == [("num", "12"), ("id", "ab")]
+    assert tokens(make_lexer([token("num"), token("id")], cache), "12ab") == [("num", "12"), ("id", "ab")]
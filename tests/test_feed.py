@@ -0,0 +1,91 @@
+import pytest
+
+import lex
+import parse
+
+def token(name):
+    return lambda lexer: lex.Token(name, lexer.buffer)
+
+def syntax_error(parser):
+    raise SyntaxError(parser.tp)
+
+def make_parser(mode, eof = 1):
+    lexer = lex.Lexer()
+    lexer.ignore = [" "]
+    for pattern, name in [("[0-9]+", "num"), ("\\(", "lp"), ("\\)", "rp"), ("\\*", "times"), ("\\-", "minus")]:
+        lexer.pattern(pattern)(token(name))
+    lexer.eof(eof)(lambda lexer: lex.Token("$", None))
+    lexer.compile()
+    parser = parse.Parser()
+    parser.terminals = ["num", "lp", "rp", "times", "minus", "$"]
+    parser.pattern("S -> E")(lambda parser, args: args[0])
+    parser.pattern("E -> E times F")(lambda parser, args: args[0] * args[2])
+    parser.pattern("E -> F")(lambda parser, args: args[0])
+    parser.pattern("F -> minus F")(lambda parser, args: -args[1])
+    parser.pattern("F -> lp E rp")(lambda parser, args: args[1])
+    parser.pattern("F -> num")(lambda parser, args: args[0].value)
+    parser.error(syntax_error)
+    parser.compile(mode)
+    parser.read(lexer)
+    return lexer, parser
+
+@pytest.mark.parametrize("mode", ["lr1", "lalr"])
+def test_feed_after_callback_error(mode):
+    lexer, parser = make_parser(mode)
+    with pytest.raises(TypeError):
+        for token in lexer.feed("-(-(4)*9 ", final = True):
+            parser.feed(token)
+    for token in lexer.feed("5", final = True):
+        parser.feed(token)
+    assert parser.finish() == "5"
+
+@pytest.mark.parametrize("mode", ["lr1", "lalr"])
+def test_tokens_after_accept_are_dropped(mode):
+    lexer, parser = make_parser(mode, 2)
+    tokens = lexer.feed("((6))", final = True)
+    assert [token.type for token in tokens][-2:] == ["$", "$"]
+    for token in tokens:
+        parser.feed(token)
+    parser.feed(lex.Token("num", "4"))
+    assert parser.finish() == "6"
+
+def test_reset():
+    lexer, parser = make_parser("lr1")
+    for token in lexer.feed("(7"):
+        parser.feed(token)
+    parser.reset()
+    assert parser.finish() is None
+    lexer.feed("", final = True)
+    for token in lexer.feed("8", final = True):
+        parser.feed(token)
+    assert parser.finish() == "8"
+
+def failing(lexer):
+    raise ValueError(lexer.buffer)
+
+def test_lexer_feed_after_callback_error():
+    lexer = lex.Lexer()
+    lexer.ignore = [" "]
+    lexer.pattern("[0-9]+")(token("num"))
+    lexer.pattern("!")(failing)
+    lexer.eof()(lambda lexer: lex.Token("$", None))
+    lexer.compile()
+    with pytest.raises(ValueError):
+        lexer.feed("12 !3")
+    assert [(token.type, token.value) for token in lexer.feed("45", final = True)] == [("num", "45"), ("$", None)]
+
+def test_streamed_positions():
+    lexer = lex.Lexer()
+    lexer.ignore = [" ", "\n"]
+    lexer.pattern("[a-z]+")(token("name"))
+    lexer.pattern("@")(lambda lexer: lex.Token("at", (lexer.line, lexer.column)))
+    lexer.eof()(lambda lexer: lex.Token("$", None))
+    lexer.compile()
+    text = "ab\n" * 2000 + "  @ x\n\n@" + "cd\n" * 3000 + "@"
+    expected = [token.value for token in lexer.tokenize(text) if token.type == "at"]
+    assert expected == [(2001, 4), (2003, 2), (5003, 2)]
+    lexer.read(text[i:i + 100] for i in range(0, len(text), 100))
+    assert [token.value for token in lexer.tokens if token.type == "at"] == expected
+    assert len(lexer.line_starts) < 100
+    with pytest.raises(ValueError):
+        lexer.position(10)
@@ -0,0 +1,48 @@
+import importlib.util
+import random
+
+import lex
+
+def name(lexer):
+    return lex.Token("name", lexer.buffer)
+
+def number(lexer):
+    return lex.Token("number", lexer.buffer)
+
+def string(lexer):
+    return lex.Token("string", lexer.buffer)
+
+def position(lexer):
+    return lex.Token("at", (lexer.line, lexer.column))
+
+def undefined(lexer):
+    return lex.Token("undefined", (lexer.buffer, lexer.line, lexer.column))
+
+def unclosed(lexer):
+    return lex.Token("unclosed", lexer.buffer)
+
+def eof(lexer):
+    return lex.Token("$", (lexer.line, lexer.column))
+
+def test_generated_lexer_matches(tmp_path):
+    lexer = lex.Lexer()
+    lexer.ignore = [" ", "\n"]
+    lexer.pattern("[a-z]+")(name)
+    lexer.pattern("[0-9]+")(number)
+    lexer.pattern('"[^"]*"')(string)
+    lexer.pattern("@")(position)
+    lexer.undefined(undefined)
+    lexer.unclosed(unclosed)
+    lexer.eof()(eof)
+    lexer.compile()
+    path = tmp_path / "generated_lexer.py"
+    lexer.generate(path)
+    spec = importlib.util.spec_from_file_location("generated_lexer", path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    generated = module.Lexer()
+    rnd = random.Random(0)
+    for _ in range(300):
+        text = "".join(rnd.choice('ab19 "\n@%') for _ in range(rnd.randint(0, 40)))
+        expected = [(token.type, token.value, token.offset) for token in lexer.tokenize(text)]
+        assert [(token.type, token.value, token.offset) for token in generated.tokenize(text)] == expected, text
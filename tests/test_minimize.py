@@ -0,0 +1,121 @@
+import random
+
+import pytest
+
+import lex
+
+class DFAGroup:
+    def __init__(self, dfas):
+        self.dfas = dfas
+        self.function = None
+        for i in dfas:
+            if i.function is not None and self.function is None:
+                self.function = i.function
+
+def dfa_in_group(dfa_node, group_list):
+    for group in group_list:
+        for dfa in group.dfas:
+            if dfa.status == dfa_node:
+                return group
+
+def reference_minimize(dfa_list, jump_table, classes):
+    """
+    The minimize_dfa lex.py had before Hopcroft's, over classes instead of the 127 ASCII characters.
+    """
+    accept = []
+    non_accept = []
+    for i in dfa_list:
+        if i.accepted:
+            accept.append(i)
+        else:
+            non_accept.append(i)
+    group_list = []
+    if non_accept:
+        group_list.append(DFAGroup(non_accept))
+    if accept:
+        group_list.append(DFAGroup(accept))
+    index = 0
+    group = group_list[index]
+    while group:
+        if len(group.dfas) == 1:
+            index += 1
+            group = group_list[index] if index < len(group_list) else None
+            continue
+        group_keys = []
+        group_values = []
+        for x in group.dfas:
+            if x.accepted:
+                gotos = x.function
+            else:
+                gotos = []
+                for k in range(len(classes)):
+                    goto_group = dfa_in_group(jump_table[x.status].get(k), group_list)
+                    gotos.append(id(goto_group) if goto_group is not None else None)
+            if gotos in group_keys:
+                group_values[group_keys.index(gotos)].append(x)
+            else:
+                group_keys.append(gotos)
+                group_values.append([x])
+        if len(group_values) == 1:
+            index += 1
+            group = group_list[index] if index < len(group_list) else None
+            continue
+        group.__init__(group_values[0])
+        for groups in group_values[1:]:
+            group_list.insert(index, DFAGroup(groups))
+            index -= 1
+        index += 1
+        group = group_list[index] if index < len(group_list) else None
+    return group_list
+
+def token(lexer):
+    return lex.Token("token", lexer.buffer)
+
+def compare(patterns, ignore = ()):
+    lexer = lex.Lexer()
+    functions = []
+    for pattern in patterns:
+        function = lambda lexer: token(lexer)
+        functions.append(function)
+        lexer.pattern(pattern)(function)
+    lexer.compile()
+    dfa_list, jump_table, classes = lex.nfa_to_dfa(lexer.nfa(), ignore)
+    group_of = lex.minimize_dfa(dfa_list, jump_table, classes)
+    assert group_of[0] == 0
+    groups = {}
+    for dfa in dfa_list:
+        groups.setdefault(group_of[dfa.status], []).append(dfa)
+    expected = reference_minimize(dfa_list, jump_table, classes)
+    assert sorted(sorted(dfa.status for dfa in group) for group in groups.values()) == sorted(sorted(dfa.status for dfa in group.dfas) for group in expected)
+    for group in expected:
+        assert group.function is DFAGroup(groups[group_of[group.dfas[0].status]]).function
+
+JSON = ["[0-9]+(\\.[0-9]+)?", '"([^"\\\\]|\\\\.)*"', "true|false|null", ",|:|\\{|\\}|\\[|\\]", "[a-z]+"]
+
+@pytest.mark.parametrize("patterns", [
+    JSON,
+    ["a", "a", "ab"],
+    ["=|==", "<|<=|<<", "[a-z_][a-z0-9_]*", "if|else|while"],
+    ["(a|b)*abb", "(a|b)*", "b+"],
+    ["/\\*([^*]|\\*+[^*/])*\\*+/", "/", "\\*"],
+    ["[^a]", "a*"],
+])
+def test_known_pattern_sets(patterns):
+    compare(patterns, [" ", "\n"])
+
+def random_pattern(rnd, depth = 0):
+    choice = rnd.randrange(7 if depth < 3 else 2)
+    if choice == 0:
+        return rnd.choice("abc")
+    if choice == 1:
+        return rnd.choice(["[ab]", "[^a]", "[a-c]", "."])
+    if choice == 2:
+        return random_pattern(rnd, depth + 1) + random_pattern(rnd, depth + 1)
+    if choice == 3:
+        return f"({random_pattern(rnd, depth + 1)}|{random_pattern(rnd, depth + 1)})"
+    return f"({random_pattern(rnd, depth + 1)}){rnd.choice('*+?')}"
+
+def test_random_pattern_sets():
+    rnd = random.Random(2)
+    for _ in range(200):
+        compare([random_pattern(rnd) for _ in range(rnd.randint(1, 4))])
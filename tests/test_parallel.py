@@ -0,0 +1,73 @@
+import random
+
+import pytest
+
+import lex
+
+def number(lexer):
+    return lex.Token("number", lexer.buffer)
+
+def name(lexer):
+    return lex.Token("name", lexer.buffer)
+
+def string(lexer):
+    return lex.Token("string", lexer.buffer)
+
+def position(lexer):
+    return lex.Token("at", (lexer.line, lexer.column))
+
+def undefined(lexer):
+    return lex.Token("undefined", lexer.buffer)
+
+def unclosed(lexer):
+    return lex.Token("unclosed", lexer.buffer)
+
+def eof(lexer):
+    return lex.Token("$", None)
+
+def make_lexer(backend, with_unclosed):
+    lexer = lex.Lexer()
+    lexer.pattern("[0-9]+")(number)
+    lexer.pattern("[a-z_][a-z0-9_]*")(name)
+    lexer.pattern('"[^"]*"')(string)
+    lexer.pattern("@")(position)
+    lexer.skip("#[^\n]*")
+    lexer.ignore = [" ", "\n", "\t"]
+    lexer.undefined(undefined)
+    if with_unclosed:
+        lexer.unclosed(unclosed)
+    lexer.eof(2)(eof)
+    lexer.compile(backend = backend)
+    return lexer
+
+def rows(buffer):
+    return [(buffer.type(i), buffer.value(i), buffer.span(i)) for i in range(len(buffer))]
+
+def random_text(rnd, size):
+    parts = []
+    while sum(map(len, parts)) < size:
+        parts.append(rnd.choice([
+            str(rnd.randint(0, 10 ** 6)), "abc", "x_1", '"a b"', '"# not a comment"', "@", "%",
+            "# comment " + "c" * rnd.randint(0, 80) + "\n", " " * rnd.randint(1, 60), "\n" * rnd.randint(1, 3),
+        ]))
+    return "".join(parts)
+
+ENDINGS = ["", " " * 150, "\n\n\t ", "# comment" + "x" * 150, '"' + "y" * 150, '"unterminated', "%", "ab", "@"]
+
+@pytest.mark.parametrize("backend", ["dfa", "re"])
+@pytest.mark.parametrize("with_unclosed", [False, True])
+def test_parallel_matches_sequential(backend, with_unclosed):
+    lexer = make_lexer(backend, with_unclosed)
+    rnd = random.Random(1)
+    for size in (0, 10, 400, 3000):
+        for ending in ENDINGS:
+            text = random_text(rnd, size) + ending
+            expected = rows(lexer.tokenize_buffer(text))
+            for chunk_size in (50, 97, 1000):
+                assert rows(lexer.tokenize_parallel(text, workers = 2, chunk_size = chunk_size)) == expected, (text, chunk_size)
+
+def test_eof_tokens_once():
+    lexer = make_lexer("dfa", False)
+    text = "a #" + "x" * 120
+    assert rows(lexer.tokenize_parallel(text, workers = 2, chunk_size = 50)) == rows(lexer.tokenize_buffer(text))
+    assert [row[0] for row in rows(lexer.tokenize_parallel(text, workers = 2, chunk_size = 50))] == ["name", "$", "$"]
@@ -0,0 +1,144 @@
+import importlib.util
+
+import pytest
+
+import lex
+import parse
+
+def make_lexer():
+    lexer = lex.Lexer()
+    lexer.ignore = [" "]
+    lexer.pattern("[0-9]+")(lambda lexer: lex.Token("num", int(lexer.buffer)))
+    lexer.pattern("\\+")(lambda lexer: lex.Token("plus", None))
+    lexer.eof()(lambda lexer: lex.Token("$", None))
+    lexer.compile()
+    return lexer
+
+def syntax_error(parser):
+    raise SyntaxError(parser.tp)
+
+def make_sum_parser(terminals):
+    parser = parse.Parser()
+    parser.terminals = terminals
+    parser.pattern("S -> E")(lambda parser, args: args[0])
+    parser.pattern("E -> E plus num")(lambda parser, args: args[0] + args[2].value)
+    parser.pattern("E -> num")(lambda parser, args: args[0].value)
+    parser.error(syntax_error)
+    parser.compile()
+    return parser
+
+def test_parsers_sharing_a_lexer():
+    lexer = make_lexer()
+    first = make_sum_parser(["num", "plus", "$"])
+    second = make_sum_parser(["plus", "$", "num"])
+    first.read(lexer)
+    second.read(lexer)
+    lexer.read("1 + 2 + 3")
+    assert first.parse() == 6
+    lexer.read("1 + 2")
+    assert second.parse("tree").root() is not None
+    lexer.read("4 + 5")
+    assert first.parse() == 9
+    for token in lexer.feed("1 + 2", final = True):
+        first.feed(token)
+    assert first.finish() == 3
+
+def compile_with_warnings(parser, mode, cache = None):
+    with pytest.warns(UserWarning) as record:
+        parser.compile(mode, cache)
+    return [str(warning.message) for warning in record]
+
+@pytest.mark.parametrize("terminals", [["a", "$"], ["a"]])
+@pytest.mark.parametrize("mode", ["lr1", "lalr"])
+def test_reduce_reduce_conflict(mode, terminals):
+    parser = parse.Parser()
+    parser.terminals = terminals
+    parser.pattern("S -> X | Y")(lambda parser, args: args[0])
+    parser.pattern("X -> a")(lambda parser, args: "X")
+    parser.pattern("Y -> a")(lambda parser, args: "Y")
+    messages = compile_with_warnings(parser, mode)
+    assert len(messages) == len(parser.conflicts) == 1
+    state, char, products, merged = parser.conflicts[0]
+    assert char == "$" and len(products) == 2 and not merged
+    assert "LALR" not in messages[0]
+    lexer = lex.Lexer()
+    lexer.pattern("a")(lambda lexer: lex.Token("a", None))
+    lexer.eof()(lambda lexer: lex.Token("$", None))
+    lexer.compile()
+    parser.read(lexer)
+    lexer.read("a")
+    assert parser.parse() == "X"
+
+def make_merge_parser():
+    parser = parse.Parser()
+    parser.terminals = ["a", "b", "c", "d", "e", "$"]
+    parser.pattern("S -> a A d | b B d | a B e | b A e")(lambda parser, args: args)
+    parser.pattern("A -> c")(lambda parser, args: args)
+    parser.pattern("B -> c")(lambda parser, args: args)
+    return parser
+
+def test_conflicts_made_by_the_lalr_merge(tmp_path):
+    parser = make_merge_parser()
+    parser.compile("lr1")
+    assert parser.conflicts == []
+    parser = make_merge_parser()
+    messages = compile_with_warnings(parser, "lalr", tmp_path / "table")
+    assert sorted(char for state, char, products, merged in parser.conflicts) == ["d", "e"]
+    assert all(merged for state, char, products, merged in parser.conflicts)
+    assert all("LALR" in message for message in messages)
+    loaded = make_merge_parser()
+    compile_with_warnings(loaded, "lalr", tmp_path / "table")
+    assert loaded.action_table is None
+    assert loaded.table.conflicts == parser.table.conflicts
+
+class Tok:
+    def __init__(self, type, value):
+        self.type = type
+        self.value = value
+
+def custom_num(lexer):
+    return Tok("num", int(lexer.buffer))
+
+def custom_plus(lexer):
+    return Tok("plus", None)
+
+def custom_eof(lexer):
+    return Tok("$", None)
+
+def custom_sum(parser, args):
+    return args[0] + args[2].value
+
+def custom_first(parser, args):
+    return args[0]
+
+def custom_value(parser, args):
+    return args[0].value
+
+def test_tokens_without_id(tmp_path):
+    lexer = lex.Lexer()
+    lexer.ignore = [" "]
+    lexer.pattern("[0-9]+")(custom_num)
+    lexer.pattern("\\+")(custom_plus)
+    lexer.eof()(custom_eof)
+    lexer.compile()
+    parser = parse.Parser()
+    parser.terminals = ["num", "plus", "$"]
+    parser.pattern("S -> E")(custom_first)
+    parser.pattern("E -> E plus num")(custom_sum)
+    parser.pattern("E -> num")(custom_value)
+    parser.error(syntax_error)
+    parser.compile()
+    parser.read(lexer)
+    lexer.read("1 + 2 + 3")
+    assert parser.parse() == 6
+    lexer.read("1 + 2")
+    assert parser.parse("tree").root() is not None
+    path = tmp_path / "generated_parser.py"
+    parser.generate(path)
+    spec = importlib.util.spec_from_file_location("generated_parser", path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    generated = module.Parser()
+    generated.read(lexer)
+    lexer.read("4 + 5")
+    assert generated.parse() == 9